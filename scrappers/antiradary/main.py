@@ -1,20 +1,49 @@
 import sys
-import time
-import random
 import logging
-import requests_cache
-import pandas as pd
-from typing import Optional, List
+from typing import Optional
 from bs4 import BeautifulSoup
 
-from scrappers.common import remove_attrs, remove_query_params
-from scrappers.exceptions import NotFound, get_log_wrapper
+from scrappers.common import (
+    Assembler as BaseAssembler,
+    FieldSpec,
+    Product as BaseProduct,
+    Record as BaseRecord,
+    html_without_attrs,
+    memoized,
+    remove_query_params,
+)
+from scrappers.cache import (
+    LISTING_EXPIRE_AFTER,
+    cached_session,
+    expire_legacy_responses,
+)
+from scrappers.fetch import FetchEngine, check_response
+from scrappers.frontier import Frontier
+from scrappers.limiter import RateLimit
+from scrappers.metrics import metrics
+from scrappers.parsing import parse
+from scrappers.snapshot import Snapshot
+from scrappers.workers import (
+    ExtractPool,
+    Page,
+    collect_records,
+    extract_records,
+    restore_records,
+)
+from scrappers.writer import TypedParquetWriter
+from scrappers.exceptions import MISSING, NotFound, get_log_wrapper
 
 
 logger = logging.getLogger("utils.antiradary")
 logging.basicConfig(level=logging.INFO)
 
-DO_SLEEP = False
+# Crawl settings, see scrappers.workers
+RATE_LIMIT = RateLimit(rate=1.0, max_rate=5.0)
+MAX_WORKERS = 8
+MAX_PER_HOST = 4
+PARSER = "html.parser"
+EXTRACT_PROCESSES = 0
+COMPACT_RECORDS = True
 MULTIPLE_JOIN_EL = "|"
 
 # Category, [available pages]
@@ -31,12 +60,66 @@ ESHOP_CATEGORY_LIST = [
     ["archiv", [1, 2, 3]],
 ]
 ESHOP_NAME = "antiradary_cz"
+SESSION_NAME = "development"
 ESHOP_URL = "https://www.antiradary.cz"
 ESHOP_URL_TEMPLATE = ESHOP_URL + "/{category}?page={page}"
 
 
-class Product:
-    soup: BeautifulSoup
+class Record(BaseRecord):
+    __slots__ = (
+        "sku",
+        "ean",
+        "name",
+        "desc",
+        "manufacturer",
+        "type",
+        "warranty",
+        "weight",
+        "availability",
+        "price",
+        "price_vat",
+        "price_discount",
+        "amount_discount",
+        "images",
+        "files",
+        "alternatives",
+        "related",
+        "parameters",
+        "short_desc",
+        "category",
+        "parent_url",
+        "parent_sku",
+        "resolved_related",
+        "resolved_alternatives",
+    )
+    INTERNED = ("manufacturer", "type", "warranty", "availability", "category")
+
+
+class Product(BaseProduct):
+    RECORD = Record
+    FIELDS = FieldSpec(
+        {
+            "sku": ".vc-commoditydetail_info .Code dd",
+            "ean": ".vc-commoditydetail_info .OtherCodes dd",
+            "name": ".vc-commoditydetail_title span",
+            "desc": ".vc-commoditydetail_description",
+            "manufacturer": ".vc-commoditydetail_info .Person dd",
+            "type": ".flags .flag",
+            "warranty": ".vc-commoditydetail_info .Warranty dd",
+            "weight": ".vc-commoditydetail_info .Weight dd",
+            "availability": ".vc-commoditydetail_info .Availability dd .availability",
+            "price": ".vc-commoditydetail_pricing .price-withoutVat dd",
+            "price_vat": ".vc-commoditydetail_pricing .price-withVat dd",
+            "price_discount": ".vc-commoditydetail_pricing .price-sale dd",
+            "amount_discount": ".vc-commoditydetail_quantitydiscounts dd",
+            "image": ".vc-commoditydetail_image a",
+            "gallery": ".vc-commoditydetail_gallery .owl-gallery a",
+            "files": ".vc-commoditydetail_files a",
+            "alternatives": "#CommodityAlternate article > a",
+            "related": "#CommodityRelated article > a",
+            "parameters": ".vc-commoditydetail_parameters",
+        }
+    )
 
     def __init__(
         self,
@@ -46,8 +129,7 @@ class Product:
         parent_url: Optional[str] = None,
         category: Optional[str] = None,
     ):
-        self.url = url
-        self.soup = soup
+        super().__init__(url, soup)
 
         self._parent_url = parent_url
         self._parent_sku = None
@@ -60,195 +142,184 @@ class Product:
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def sku(self):
-        try:
-            return self.soup.css.select(".vc-commoditydetail_info .Code dd")[
-                0
-            ].text.strip()
-        except IndexError:
-            raise NotFound("SKU not found")
+        found = self.select("sku")
+        if not found:
+            return MISSING
+        return found[0].text.strip()
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def ean(self):
-        try:
-            return self.soup.css.select(".vc-commoditydetail_info .OtherCodes dd")[
-                0
-            ].text.strip()
-        except IndexError:
-            raise NotFound("Ean not found")
+        found = self.select("ean")
+        if not found:
+            return MISSING
+        return found[0].text.strip()
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def name(self):
-        try:
-            return self.soup.css.select(".vc-commoditydetail_title span")[
-                0
-            ].text.strip()
-        except IndexError:
-            raise NotFound("Name not found")
+        found = self.select("name")
+        if not found:
+            return MISSING
+        return found[0].text.strip()
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def desc(self):
-        desc = self.soup.css.select(".vc-commoditydetail_description")
+        desc = self.select("desc")
         if len(desc):
-            el = remove_attrs(desc[0])
-            return str(el)
-        raise NotFound("Desc not found")
+            return html_without_attrs(desc[0])
+        return MISSING
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def manufacturer(self):
-        try:
-            manufacturer = self.soup.css.select(".vc-commoditydetail_info .Person dd")[
-                0
-            ].text.strip()
-        except IndexError:
-            raise NotFound("Manufacturer not found")
+        found = self.select("manufacturer")
+        if not found:
+            return MISSING
+        manufacturer = found[0].text.strip()
         if manufacturer and isinstance(manufacturer, str) and manufacturer[-1] == ",":
             manufacturer = manufacturer[:-1]
         return manufacturer
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def type(self):
-        flags = [el.text for el in self.soup.css.select(".flags .flag")]
+        flags = [el.text for el in self.select("type")]
         if not len(flags):
-            raise NotFound("Flags not found")
+            return MISSING
         return flags
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def warranty(self):
-        try:
-            return self.soup.css.select(".vc-commoditydetail_info .Warranty dd")[
-                0
-            ].text.strip()
-        except IndexError:
-            raise NotFound("Warranty not found")
+        found = self.select("warranty")
+        if not found:
+            return MISSING
+        return found[0].text.strip()
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def weight(self):
-        try:
-            return self.soup.css.select(".vc-commoditydetail_info .Weight dd")[
-                0
-            ].text.strip()
-        except IndexError:
-            raise NotFound("Weight not found")
+        found = self.select("weight")
+        if not found:
+            return MISSING
+        return found[0].text.strip()
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def availability(self):
-        try:
-            return self.soup.css.select(
-                ".vc-commoditydetail_info .Availability dd .availability"
-            )[0].text.strip()
-        except IndexError:
-            raise NotFound("Availability not found")
+        found = self.select("availability")
+        if not found:
+            return MISSING
+        return found[0].text.strip()
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def price(self):
-        try:
-            return float(
-                self.soup.css.select(
-                    ".vc-commoditydetail_pricing .price-withoutVat dd"
-                )[0]["data-price"]
-            )
-        except IndexError:
-            raise NotFound("Price not found")
+        found = self.select("price")
+        if not found:
+            return MISSING
+        return float(found[0]["data-price"])
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def price_vat(self):
-        try:
-            return float(
-                self.soup.css.select(".vc-commoditydetail_pricing .price-withVat dd")[
-                    0
-                ]["data-price"]
-            )
-        except IndexError:
-            raise NotFound("Price VAT not found")
+        found = self.select("price_vat")
+        if not found:
+            return MISSING
+        return float(found[0]["data-price"])
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def price_discount(self):
-        try:
-            price = float(
-                self.soup.css.select(".vc-commoditydetail_pricing .price-sale dd")[0][
-                    "data-price-discount"
-                ]
-            )
-        except IndexError:
-            raise NotFound("Discount price not found")
+        found = self.select("price_discount")
+        if not found:
+            return MISSING
+        price = float(found[0]["data-price-discount"])
 
         if not price:
-            raise NotFound("Discount price is invalid")
+            return MISSING
         return price
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def amount_discount(self):
-        try:
-            return self.soup.css.select(".vc-commoditydetail_quantitydiscounts dd")[
-                0
-            ].text.strip()
-        except IndexError:
-            raise NotFound("Amount discount not found")
+        found = self.select("amount_discount")
+        if not found:
+            return MISSING
+        return found[0].text.strip()
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def images(self):
         items = []
 
-        main = self.soup.css.select(".vc-commoditydetail_image a")
+        main = self.select("image")
         if len(main):
             items.append(main[0]["href"])
 
-        for item in self.soup.css.select(".vc-commoditydetail_gallery .owl-gallery a"):
+        for item in self.select("gallery"):
             items.append(item["href"])
 
         items = [remove_query_params(item) for item in items]
         if not len(items):
-            raise NotFound("Images not found")
+            return MISSING
 
         return items
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def files(self):  # TODO: fix relative url
         items = []
-        for item in self.soup.css.select(".vc-commoditydetail_files a"):
+        for item in self.select("files"):
             items.append(item["href"])
 
         items = [remove_query_params(item) for item in items]
         if not len(items):
-            raise NotFound("Files not found")
+            return MISSING
 
         return items
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def alternatives(self):
         items = []
-        for item in self.soup.css.select("#CommodityAlternate article > a"):
+        for item in self.select("alternatives"):
             href = item["href"]
             if "http" not in href:
                 href = ESHOP_URL + href
+            items.append(href)
 
         items = [remove_query_params(item) for item in items]
         if not len(items):
-            raise NotFound("Alternatives not found")
+            return MISSING
 
         return items
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def related(self):
         items = []
-        for item in self.soup.css.select("#CommodityRelated article > a"):
+        for item in self.select("related"):
             href = item["href"]
             if "http" not in href:
                 href = ESHOP_URL + href
@@ -256,22 +327,22 @@ class Product:
 
         items = [remove_query_params(item) for item in items]
         if not len(items):
-            raise NotFound("Related not found")
+            return MISSING
 
         return items
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def parameters(self):  # TODO: Table?
-        content = self.soup.css.select(".vc-commoditydetail_parameters")
+        content = self.select("parameters")
         if len(content):
-            el = remove_attrs(content[0])
-            el = str(el).strip()
+            el = html_without_attrs(content[0]).strip()
             if not el:
-                raise NotFound("Parameters not found")
+                return MISSING
             return el
         else:
-            raise NotFound("Parameters not found")
+            return MISSING
 
     @property
     def resolved_related(self):
@@ -279,12 +350,20 @@ class Product:
             raise NotFound("Related not found")
         return self._resolved_related
 
+    @resolved_related.setter
+    def resolved_related(self, value):
+        self._resolved_related = value
+
     @property
     def resolved_alternatives(self):
         if self._resolved_alternatives is None:
             raise NotFound("Alternatives not found")
         return self._resolved_alternatives
 
+    @resolved_alternatives.setter
+    def resolved_alternatives(self, value):
+        self._resolved_alternatives = value
+
     @property
     def short_desc(self):
         if self._short_desc is None:
@@ -297,15 +376,26 @@ class Product:
             raise NotFound("Category not found")
         return self._category
 
+    @property
+    def parent_url(self):
+        return self._parent_url
+
     @property
     def parent_sku(self):
         if self._parent_sku is None:
             raise NotFound("Parent sku not found")
         return self._parent_sku
 
+    @parent_sku.setter
+    def parent_sku(self, value):
+        self._parent_sku = value
+
 
-class Assembler:
+class Assembler(BaseAssembler):
     INDEX = "product_sku"
+    SKU_FIELD = "sku"
+    SKU_COLUMN = "product_sku"
+    BASE_URL = ESHOP_URL
     COLUMNS_MAP = [
         ["url", "url"],
         ["sku", "product_sku"],
@@ -331,171 +421,181 @@ class Assembler:
         ["resolved_alternatives", "alternative_products"],
     ]
     COLUMNS = [col for _, col in COLUMNS_MAP]
-
-    def __init__(self):
-        self.table = pd.DataFrame(columns=self.COLUMNS, index=[self.INDEX]).dropna()
-        self._products_url_map = {}
-
-    @property
-    def products(self):
-        return self._products_url_map.values()
-
-    def collect(self, product: Product):
-        self._products_url_map[product.url] = product
-
-    def _get_sku_list(self, urls: List[str]):
-        sku_list = []
-        for url in urls:
-            try:
-                related = self._products_url_map[url]
-            except KeyError:
-                logger.warning(
-                    f"Failed to resolve product with url: {url} for {product.url}"
-                )
-            else:
-                sku_list.append(related.sku)
-        return sku_list
-
-    def _finalize_value(self, value):
-        if isinstance(value, list):
-            value = [str(v).strip() for v in value]
-            value = MULTIPLE_JOIN_EL.join(value)
-        value = str(value).strip()
-        return value
+    TYPES = {
+        "price": "float",
+        "price_vat": "float",
+        "product_sales": "float",
+        "image_url": "list",
+        "file_url": "list",
+        "related_products": "list",
+        "alternative_products": "list",
+        "typ": "list",
+        "category_name": "category",
+        "warranty": "category",
+        "manufacturer": "category",
+        "availability": "category",
+    }
 
     def build(self, product: Product):
         product_dict = {}
+        index = self.sku_index
 
-        if product._parent_url is not None:
-            try:
-                product._parent_sku = self._get_sku_list([product._parent_url])[0]
-            except NotFound:
-                pass
+        if product.parent_url is not None:
+            parent_sku = index.resolve(product.url, "parent", [product.parent_url])
+            if parent_sku:
+                product.parent_sku = parent_sku[0]
 
-        try:
-            product._resolved_related = self._get_sku_list(product.related)
-        except NotFound:
-            pass
+        related = product.get("related")
+        if related is not None:
+            product.resolved_related = index.resolve(product.url, "related", related)
 
-        try:
-            product._resolved_alternatives = self._get_sku_list(product.alternatives)
-        except NotFound:
-            pass
+        alternatives = product.get("alternatives")
+        if alternatives is not None:
+            product.resolved_alternatives = index.resolve(
+                product.url, "alternative", alternatives
+            )
 
         for prop, col in self.COLUMNS_MAP:
-            try:
-                value = getattr(product, prop)
-            except NotFound:
-                value = ""
-            else:
-                value = self._finalize_value(value)
+            product_dict[col] = product.get(prop)
 
-            product_dict[col] = value
+        self.rows.append(product_dict)
 
-        row = pd.DataFrame(product_dict, index=[self.INDEX])
-        self.table = pd.concat([self.table, row], ignore_index=True)
+
+def extract_page(page: Page) -> Product:
+    """Product of a fetched page with its `(parent_url, short_desc, category)` context."""
+    parent_url, short_desc, category = page.context
+    soup = parse(page, PARSER)
+    return Product(
+        page.url, soup, short_desc=short_desc, category=category, parent_url=parent_url
+    )
 
 
 class Workflow:
-    session = requests_cache.CachedSession("development")
+    # Set by `use_engine`, `main` opens the site's own session if not given one
+    session = None
+    engine: Optional[FetchEngine] = None
 
     @staticmethod
-    def product_url_generator(template: str):
-        for category, pages in ESHOP_CATEGORY_LIST:
-            for page in pages:
-                content_url = template.format(page=page, category=category)
-
-                logger.info(f"Fetching category: {content_url}")
-                response = Workflow.session.get(content_url)
-                try:
-                    assert response.status_code == 200
-                except AssertionError as exc:
-                    logger.info(f"Fetch failed, stop iteration")
-                    return
-                else:
-                    if DO_SLEEP:
-                        cooldown = random.randint(5, 20)
-                        logger.info(f"Sleep: {cooldown}")
-                        time.sleep(cooldown)
-                soup = BeautifulSoup(response.content, "html.parser")
-
-                category_name = soup.css.select(".categoryName")[0].text.strip()
-
-                articles = soup.css.select(".commodities > article.commodityBox")
-                annotations = soup.css.select(".annotation")
-
-                logger.info(f"Found: {len(articles)} products in {category_name}")
-
-                for article, annotation in zip(articles, annotations):
-                    parent_url = ESHOP_URL + article.css.select("a")[0].get("href")
-                    short_desc = annotation.text
-                    yield parent_url, None, short_desc, category_name
-                    if len(article.css.select(".goToDetail-variants")):
-                        for variant_url in Workflow.variant_url_generator(parent_url):
-                            yield variant_url, parent_url, short_desc, category_name
+    def use_engine(engine: FetchEngine):
+        """Fetch through `engine` and its session instead of the site's own."""
+        engine.limiter.configure(ESHOP_URL, RATE_LIMIT)
+        Workflow.session = engine.session
+        Workflow.engine = engine
 
     @staticmethod
-    def variant_url_generator(parent_product_url: str):
-        logger.info(f"Fetching parent product: {parent_product_url}")
-        response = Workflow.session.get(parent_product_url)
-        try:
-            assert response.status_code == 200
-        except AssertionError:
-            logger.info(f"Fetch failed, stop iteration")
-            return
-        else:
-            if DO_SLEEP:
-                cooldown = random.randint(5, 20)
-                logger.info(f"Sleep: {cooldown}")
-                time.sleep(cooldown)
-        soup = BeautifulSoup(response.content, "html.parser")
-        variants = [
-            a.get("href") for a in soup.css.select(".variants-catalog article > a")
+    def product_url_generator(template: str):
+        category_urls = [
+            (template.format(page=page, category=category), None)
+            for category, pages in ESHOP_CATEGORY_LIST
+            for page in pages
         ]
-        logger.info(f"+ {len(variants)} variants found")
-        for url in variants:
-            yield ESHOP_URL + url
+        parents = []
+        for fetched in Workflow.engine.map(
+            category_urls, expire_after=LISTING_EXPIRE_AFTER
+        ):
+            logger.info(f"Fetched category: {fetched.url}")
+            try:
+                response = check_response(fetched)
+            except RuntimeError as exc:
+                logger.info(f"Fetch failed, skip category: {exc}")
+                continue
+            soup = parse(response, PARSER)
+
+            category_name = soup.css.select(".categoryName")[0].text.strip()
+
+            articles = soup.css.select(".commodities > article.commodityBox")
+            annotations = soup.css.select(".annotation")
+
+            logger.info(f"Found: {len(articles)} products in {category_name}")
+
+            for article, annotation in zip(articles, annotations):
+                parent_url = ESHOP_URL + article.css.select("a")[0].get("href")
+                short_desc = annotation.text
+                yield parent_url, None, short_desc, category_name
+                if len(article.css.select(".goToDetail-variants")):
+                    parents.append((parent_url, (short_desc, category_name)))
+
+        for (
+            parent_url,
+            variant_url,
+            (short_desc, category_name),
+        ) in Workflow.variant_url_generator(parents):
+            yield variant_url, parent_url, short_desc, category_name
 
     @staticmethod
-    def product_processing(
-        url: str,
-        short_desc: Optional[str] = None,
-        parent_url: Optional[str] = None,
-        category: Optional[str] = None,
-    ) -> Product:
-        response = Workflow.session.get(url)
-        try:
-            assert response.status_code == 200
-        except AssertionError as exc:
-            raise RuntimeError(f"Product fetch failed: {url}") from exc
-
-        soup = BeautifulSoup(response.content, "html.parser")
-        return Product(
-            url, soup, short_desc=short_desc, category=category, parent_url=parent_url
-        )
+    def variant_url_generator(parents):
+        for fetched in Workflow.engine.map(parents):
+            logger.info(f"Fetched parent product: {fetched.url}")
+            try:
+                response = check_response(fetched)
+            except RuntimeError as exc:
+                logger.info(f"Fetch failed, skip variants: {exc}")
+                continue
+            soup = parse(response, PARSER)
+            variants = [
+                a.get("href") for a in soup.css.select(".variants-catalog article > a")
+            ]
+            logger.info(f"+ {len(variants)} variants found")
+            for url in variants:
+                yield fetched.url, ESHOP_URL + url, fetched.context
 
 
 LIMIT = None
-if __name__ == "__main__":
-    count = 0
 
-    assembler = Assembler()
-    for url, parent_url, short_desc, category in Workflow.product_url_generator(
-        ESHOP_URL_TEMPLATE
-    ):
-        count += 1
-        try:
-            product = Workflow.product_processing(
-                url, parent_url=parent_url, short_desc=short_desc, category=category
-            )
-        except RuntimeError as exc:
-            logger.error(url)
-            logger.exception(exc)
-            continue
-        assembler.collect(product)
+
+def main(resume: bool = False, engine: Optional[FetchEngine] = None):
+    """Crawl the eshop into results/, `resume` continues an interrupted run.
+
+    `engine` replaces the site's fetch engine, e.g. to share one across sites.
+    """
+    if engine is None:
+        session = cached_session(SESSION_NAME)
+        expire_legacy_responses(session.cache)
+        engine = FetchEngine(
+            session,
+            max_workers=MAX_WORKERS,
+            per_host=MAX_PER_HOST,
+            rate_limit=RATE_LIMIT,
+        )
+    Workflow.use_engine(engine)
+
+    frontier = Frontier(f"results/{ESHOP_NAME}.frontier.sqlite", resume=resume)
+    snapshot = Snapshot(f"results/{ESHOP_NAME}.csv", sku_column="product_sku")
+    typed = TypedParquetWriter(
+        f"results/{ESHOP_NAME}.parquet", Assembler.COLUMNS, Assembler.TYPES
+    )
+    assembler = Assembler(compact=COMPACT_RECORDS, sink=snapshot, typed_sink=typed)
+    restore_records(frontier, snapshot, assembler, assembler.collect, Record)
+
+    pool = ExtractPool(extract_page, EXTRACT_PROCESSES) if EXTRACT_PROCESSES else None
+
+    items = frontier.items(
+        "products", lambda: Workflow.product_url_generator(ESHOP_URL_TEMPLATE)
+    )
+    items = (
+        (url, (parent_url, short_desc, category))
+        for url, parent_url, short_desc, category in items
+    )
+    results = extract_records(Workflow.engine, items, extract_page, snapshot, pool)
+    count = collect_records(
+        results, frontier, snapshot, assembler, assembler.collect, LIMIT
+    )
 
     logger.info(f"Collected: {count} products")
-    for product in assembler.products:
-        assembler.build(product)
+    with metrics.timer("assemble"):
+        for product in assembler.products:
+            assembler.build(product)
+        assembler.flush()
+    assembler.write_edges(f"results/{ESHOP_NAME}-edges.csv")
+
+    if pool is not None:
+        pool.close()
+    snapshot.close()
+    typed.close()
+    frontier.close()
 
-    assembler.table.to_csv(f"results/{ESHOP_NAME}.csv")
+
+if __name__ == "__main__":
+    metrics.start(f"results/{ESHOP_NAME}.metrics.json")
+    main(resume="--resume" in sys.argv[1:])
+    metrics.finish()
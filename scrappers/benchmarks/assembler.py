@@ -0,0 +1,85 @@
+"""Assembler build time on synthetic products.
+
+Run `python -m scrappers.benchmarks.assembler [--legacy]`, `--legacy` also times the
+previous per-row `pd.concat` build for sizes up to 10k.
+"""
+import sys
+import time
+import random
+import string
+
+import pandas as pd
+
+from scrappers.common import Assembler, Product
+from scrappers.exceptions import NotFound
+
+SIZES = [1_000, 10_000, 100_000]
+LEGACY_MAX_SIZE = 10_000
+
+
+class SyntheticProduct(Product):
+    def __init__(self, i: int):
+        super().__init__(f"https://example.com/product/{i}", None)
+        rnd = random.Random(i)
+        self.sku = f"{i:06d}-{rnd.randint(0, 999):03d}"
+        self.product_name = "".join(rnd.choices(string.ascii_letters, k=24))
+        self.colors = ["black", "white", "red"][: rnd.randint(1, 3)]
+        self.product_description = "<div>" + "lorem ipsum " * 40 + "</div>"
+        self.images = [f"https://example.com/img/{i}-{n}.jpg" for n in range(4)]
+
+    @property
+    def price(self):
+        if self.sku.endswith("7"):
+            raise NotFound()
+        return 199.9
+
+
+class SyntheticAssembler(Assembler):
+    INDEX = "url"
+    COLUMNS = ["url", "sku", "product_name", "colors", "product_description", "images", "price"]
+
+    def build_legacy(self):
+        table = pd.DataFrame(columns=self.COLUMNS, index=[self.INDEX]).dropna()
+        for product in self.products:
+            product_dict = {}
+            for col in self.COLUMNS:
+                try:
+                    value = getattr(product, col)
+                except NotFound:
+                    value = ''
+                else:
+                    value = self._finalize_value(value)
+
+                product_dict[col] = value
+
+            row = pd.DataFrame(product_dict, index=[self.INDEX])
+            table = pd.concat([table, row], ignore_index=True)
+        return table
+
+
+def measure(fn):
+    start = time.perf_counter()
+    table = fn()
+    return time.perf_counter() - start, len(table)
+
+
+def main(legacy: bool = False):
+    print(f"{'products':>10} {'row buffer [s]':>15} {'legacy concat [s]':>18}")
+    for size in SIZES:
+        assembler = SyntheticAssembler()
+        for i in range(size):
+            assembler.collect(SyntheticProduct(i))
+
+        elapsed, rows = measure(assembler.build)
+        assert rows == size
+
+        legacy_elapsed = "-"
+        if legacy and size <= LEGACY_MAX_SIZE:
+            legacy_elapsed, _ = measure(assembler.build_legacy)
+            legacy_elapsed = f"{legacy_elapsed:.3f}"
+
+        print(f"{size:>10} {elapsed:>15.3f} {legacy_elapsed:>18}")
+
+
+if __name__ == "__main__":
+    main(legacy="--legacy" in sys.argv[1:])
@@ -0,0 +1,243 @@
+"""Extraction speed of a site's Product and Assembler on a fixed corpus of stored pages.
+
+Export a corpus from a requests_cache SQLite file once:
+`python -m scrappers.benchmarks.extraction export ziener production-27-12-2023`
+then run against it, optionally comparing with a previous result:
+`python -m scrappers.benchmarks.extraction run ziener --json ziener.json --compare old.json`.
+
+Pages are classified as products if the site's key field is found, listings otherwise.
+Reported are pages/sec, the time per field (including parsing and selection) and the
+peak memory of extracting and building the whole corpus. Sites extracting all fields
+in the Product constructor, i.e. without `memoized` properties (millers_oils), report
+their extraction as `_init` only.
+"""
+
+import gc
+import sys
+import json
+import time
+import argparse
+import importlib
+import platform
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+import requests_cache
+from requests.models import Response
+
+from scrappers.parsing import PARSERS, parse
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+# Field found on product pages only
+KEY_FIELDS = {
+    "antiradary": "sku",
+    "millers_oils": "product_sku",
+    "schoeffel": "product_name",
+    "ziener": "product_name",
+}
+
+
+def load_site(site: str):
+    return importlib.import_module(f"scrappers.{site}.main")
+
+
+def is_product(module, site: str, response) -> bool:
+    try:
+        product = module.Product(response.url, parse(response))
+        return bool(getattr(product, KEY_FIELDS[site]))
+    except Exception:
+        return False
+
+
+def export(site: str, cache: str, out: Path, limit: int):
+    module = load_site(site)
+    session = requests_cache.CachedSession(cache)
+    out.mkdir(parents=True, exist_ok=True)
+
+    manifest, counts = [], defaultdict(int)
+    for response in session.cache.responses.values():
+        content_type = response.headers.get("content-type", "")
+        if response.status_code != 200 or "html" not in content_type:
+            continue
+        kind = "product" if is_product(module, site, response) else "listing"
+        if counts[kind] == limit:
+            continue
+        counts[kind] += 1
+
+        name = f"{len(manifest):05d}.html"
+        (out / name).write_bytes(response.content)
+        manifest.append(
+            {
+                "file": name,
+                "url": response.url,
+                "kind": kind,
+                "content_type": content_type,
+            }
+        )
+
+    (out / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    print(f"Exported {dict(counts)} pages to {out}")
+
+
+def load_corpus(path: Path):
+    pages = []
+    for entry in json.loads((path / "manifest.json").read_text()):
+        response = Response()
+        response.status_code = 200
+        response.url = entry["url"]
+        response.headers["content-type"] = entry["content_type"]
+        response._content = (path / entry["file"]).read_bytes()
+        pages.append((entry["kind"], response))
+    return pages
+
+
+def extract(module, response, parser: str, times: dict):
+    started = time.perf_counter()
+    soup = parse(response, parser)
+    parsed = time.perf_counter()
+    times["_parse"] += parsed - started
+
+    product = module.Product(response.url, soup)
+    times["_init"] += time.perf_counter() - parsed
+
+    # Fields are extracted on access, not already in the constructor
+    if module.Product._extractors:
+        if product.FIELDS is not None:
+            started = time.perf_counter()
+            product.matches
+            times["_select"] += time.perf_counter() - started
+
+        for field in sorted(module.Product.RECORD._fields - {"url"}):
+            started = time.perf_counter()
+            product.get(field)
+            times[field] += time.perf_counter() - started
+
+    record = product.to_record()
+    product.release()
+    return record
+
+
+def build(site: str, module, records: list):
+    if site == "millers_oils":
+        assembler = module.Assembler(
+            module.INDEX, module.COLUMNS, module.COLUMNS_MAP, compact=True
+        )
+        for record in records:
+            assembler.collect(record)
+        for product in assembler.products:
+            assembler.add(product)
+        return assembler.table
+
+    assembler = module.Assembler(compact=True)
+    for record in records:
+        assembler.collect(record)
+    if site == "antiradary":
+        for product in assembler.products:
+            assembler.build(product)
+        return assembler.table
+    return assembler.build()
+
+
+def run_corpus(site: str, module, pages: list, parser: str, times: dict):
+    records = []
+    for kind, response in pages:
+        if kind == "product":
+            records.append(extract(module, response, parser, times))
+    started = time.perf_counter()
+    build(site, module, records)
+    times["_build"] += time.perf_counter() - started
+    return records
+
+
+def run(site: str, corpus: Path, parser: Optional[str], repeat: int) -> dict:
+    module = load_site(site)
+    parser = parser or module.PARSER
+    pages = load_corpus(corpus)
+    products = sum(kind == "product" for kind, _ in pages)
+
+    times = defaultdict(float)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        run_corpus(site, module, pages, parser, times)
+    elapsed = time.perf_counter() - started
+
+    gc.collect()
+    tracemalloc.start()
+    run_corpus(site, module, pages, parser, defaultdict(float))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "site": site,
+        "parser": parser,
+        "python": platform.python_version(),
+        "products": products,
+        "repeat": repeat,
+        "pages_per_sec": products * repeat / elapsed if elapsed else None,
+        "build_seconds": times.pop("_build") / repeat,
+        "field_seconds": {
+            field: seconds / repeat for field, seconds in sorted(times.items())
+        },
+        "peak_memory_bytes": peak,
+    }
+
+
+def compare(result: dict, baseline: dict):
+    def line(name, new, old):
+        change = f"{(new - old) / old:+.1%}" if old else "-"
+        print(f"{name:>28} {old:>12.4f} {new:>12.4f} {change:>8}")
+
+    print(f"{'':>28} {'baseline':>12} {'current':>12}")
+    line("pages/sec", result["pages_per_sec"], baseline["pages_per_sec"])
+    line("build [ms]", result["build_seconds"] * 1e3, baseline["build_seconds"] * 1e3)
+    line(
+        "peak memory [MB]",
+        result["peak_memory_bytes"] / 2**20,
+        baseline["peak_memory_bytes"] / 2**20,
+    )
+    for field, seconds in result["field_seconds"].items():
+        old = baseline["field_seconds"].get(field, 0.0)
+        line(f"{field} [ms]", seconds * 1e3, old * 1e3)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="store a corpus from a cache")
+    export_parser.add_argument("site", choices=sorted(KEY_FIELDS))
+    export_parser.add_argument("cache", help="requests_cache session name")
+    export_parser.add_argument("--limit", type=int, default=200, help="pages per kind")
+    export_parser.add_argument("--out", type=Path, default=None)
+
+    run_parser = commands.add_parser("run", help="benchmark against a stored corpus")
+    run_parser.add_argument("site", choices=sorted(KEY_FIELDS))
+    run_parser.add_argument("--corpus", type=Path, default=None)
+    run_parser.add_argument(
+        "--parser", default=None, choices=PARSERS, help="the site's PARSER by default"
+    )
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--json", type=Path, default=None, help="write results")
+    run_parser.add_argument("--compare", type=Path, default=None, help="baseline JSON")
+
+    args = arg_parser.parse_args()
+    corpus = FIXTURES_DIR / args.site
+    if args.command == "export":
+        export(args.site, args.cache, args.out or corpus, args.limit)
+        return 0
+
+    result = run(args.site, args.corpus or corpus, args.parser, args.repeat)
+    if args.json is not None:
+        args.json.write_text(json.dumps(result, indent=2))
+    if args.compare is not None:
+        compare(result, json.loads(args.compare.read_text()))
+    else:
+        print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
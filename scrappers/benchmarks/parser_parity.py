@@ -0,0 +1,85 @@
+"""Compare a site's extracted product values between two parser backends.
+
+Pages are read from a requests_cache SQLite file, e.g.
+`python -m scrappers.benchmarks.parser_parity ziener production-27-12-2023 --parser lxml`.
+Exits with 1 if any page extracts differently than with `html.parser`.
+"""
+
+import argparse
+import importlib
+import sys
+
+import requests_cache
+
+from scrappers.exceptions import NotFound
+from scrappers.parsing import DEFAULT_PARSER, PARSERS, parse
+
+# Filled in during the Assembler build, not extracted from the page
+RESOLVED_FIELDS = {
+    "parent_sku",
+    "resolved_related",
+    "resolved_alternatives",
+    "related_product_sku_list",
+}
+
+
+def extract(module, response, parser: str) -> dict:
+    try:
+        product = module.Product(response.url, parse(response, parser))
+    except Exception as e:
+        return {"__init__": type(e).__name__}
+
+    values = {}
+    for field in sorted(module.Product.RECORD._fields - RESOLVED_FIELDS):
+        try:
+            value = getattr(product, field)
+        except NotFound:
+            value = NotFound.__name__
+        except Exception as e:
+            value = type(e).__name__
+        if isinstance(value, list) and value and hasattr(value[0], "__dict__"):
+            value = [vars(v) for v in value]
+        values[field] = value
+    return values
+
+
+def mismatches(module, responses, parser: str):
+    """`(url, field, expected, actual)` of the values `parser` extracts differently than
+    `DEFAULT_PARSER` from the html `responses`."""
+    for response in responses:
+        expected = extract(module, response, DEFAULT_PARSER)
+        actual = extract(module, response, parser)
+        for field, value in expected.items():
+            if actual.get(field) != value:
+                yield response.url, field, value, actual.get(field)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("site", help="scrapper package, e.g. antiradary")
+    arg_parser.add_argument("cache", help="requests_cache session name")
+    arg_parser.add_argument("--parser", default="lxml", choices=PARSERS)
+    arg_parser.add_argument("--limit", type=int, default=None)
+    args = arg_parser.parse_args()
+
+    module = importlib.import_module(f"scrappers.{args.site}.main")
+
+    session = requests_cache.CachedSession(args.cache)
+    responses = [
+        response
+        for response in session.cache.responses.values()
+        if response.status_code == 200
+        and "html" in response.headers.get("content-type", "")
+    ][: args.limit]
+
+    found = 0
+    for url, field, expected, actual in mismatches(module, responses, args.parser):
+        found += 1
+        print(f"{url} {field}: {expected!r} != {actual!r}")
+
+    print(f"Pages: {len(responses)}, mismatches: {found}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
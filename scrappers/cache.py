@@ -0,0 +1,55 @@
+import logging
+from datetime import timedelta
+
+from requests_cache.backends.sqlite import SQLiteCache
+from requests_cache.policy.expiration import add_tzinfo, get_expiration_datetime
+
+from scrappers.client import http_session
+
+
+logger = logging.getLogger("scrappers.cache")
+
+# Expiry per url class, pass the listing and static ones with `expire_after=` per request
+LISTING_EXPIRE_AFTER = timedelta(hours=12)
+PRODUCT_EXPIRE_AFTER = timedelta(days=7)
+STATIC_EXPIRE_AFTER = timedelta(days=30)
+
+
+def cached_session(name: str, expire_after=PRODUCT_EXPIRE_AFTER):
+    """Cached session whose responses expire, `expire_after` by default.
+
+    Expired responses with an ETag or Last-Modified header are revalidated by
+    requests_cache, an unchanged page costs a 304 instead of the full body. If the
+    revalidation fails, the stale response is used. Connections are pooled and
+    retried, see `scrappers.client`. Caches filled before responses expired need
+    `expire_legacy_responses` once.
+    """
+    return http_session(name, expire_after)
+
+
+def expire_legacy_responses(cache, expire_after=PRODUCT_EXPIRE_AFTER):
+    """Set an expiry to responses cached without one, counted from when they were cached.
+
+    Run it from a crawl's entry point, not on import, it rewrites every such response.
+    """
+    if not isinstance(cache, SQLiteCache):
+        return
+
+    with cache.responses.connection() as con:
+        keys = [
+            row[0]
+            for row in con.execute(
+                f"SELECT key FROM {cache.responses.table_name} WHERE expires IS NULL"
+            )
+        ]
+    for key in keys:
+        response = cache.responses.get(key)
+        if response is None:
+            continue
+        response.expires = get_expiration_datetime(
+            expire_after, start_time=add_tzinfo(response.created_at)
+        )
+        cache.responses[key] = response
+
+    if keys:
+        logger.info(f"Set expiry of {len(keys)} responses cached without one")
@@ -0,0 +1,96 @@
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+
+# Seconds to connect and to wait for data, for requests sent without a timeout
+DEFAULT_TIMEOUT = (5, 30)
+# Retries of failed connections and of responses with RETRY_STATUSES, backing off
+# 0.5, 1, 2... seconds, or as long as the Retry-After header asks
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Hosts with a connection pool kept, connections kept per host
+POOL_HOSTS = 16
+POOL_MAXSIZE = 8
+
+# gzip and deflate, br if the brotli package is installed
+ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter sending requests without a timeout with `timeout`."""
+
+    def __init__(self, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def configure(
+    session: requests.Session,
+    timeout=DEFAULT_TIMEOUT,
+    retries: int = RETRIES,
+    backoff_factor: float = BACKOFF_FACTOR,
+    pool_maxsize: int = POOL_MAXSIZE,
+) -> requests.Session:
+    """Mount pooled, retrying adapters with a default `timeout` on `session`."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        timeout=timeout,
+        max_retries=retry,
+        pool_connections=POOL_HOSTS,
+        pool_maxsize=pool_maxsize,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    return session
+
+
+def http_session(
+    cache_name: Optional[str] = None, expire_after=None, **kwargs
+) -> requests.Session:
+    """Pooled session, see `configure` for `kwargs`.
+
+    With `cache_name`, responses are cached by requests_cache in that SQLite file and
+    expire `expire_after`, stale ones are used if fetching them again fails.
+    """
+    if cache_name is None:
+        return configure(requests.Session(), **kwargs)
+
+    try:
+        import requests_cache
+    except ImportError as e:
+        raise RuntimeError("Caching requires requests-cache") from e
+    cache_kwargs = {} if expire_after is None else {"expire_after": expire_after}
+    session = requests_cache.CachedSession(
+        cache_name, stale_if_error=True, **cache_kwargs
+    )
+    return configure(session, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def shared_session() -> requests.Session:
+    """One uncached session for the whole process, created on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = http_session()
+        return _session
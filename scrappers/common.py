@@ -1,7 +1,25 @@
-from copy import copy
+import sys
+import time
+import logging
+import re
+from functools import wraps
+from pathlib import Path
 
-from urllib.parse import urlparse, urlunparse
-from bs4 import BeautifulSoup
+import pandas as pd
+import soupsieve as sv
+from urllib.parse import urljoin, urlparse, urlunparse
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import (
+    DEFAULT_OUTPUT_ENCODING,
+    AttributeValueWithCharsetSubstitution,
+    PreformattedString,
+)
+
+from scrappers.exceptions import MISSING, NotFound
+from scrappers.metrics import metrics
+
+
+logger = logging.getLogger("scrappers.common")
 
 
 def remove_query_params(url):
@@ -11,24 +29,411 @@ def remove_query_params(url):
     return urlunparse(modified_url)
 
 
-def remove_attrs(el):
-    el = copy(el)
-    el.attrs = {}
-    for tag in el.find_all(True):
-        tag.attrs = {}
-    return el
+def canonical_url(url, base=None):
+    """`url` resolved against `base`, without query, fragment and trailing slash.
+
+    Urls differing only in these, or in the case of scheme and host, are equal.
+    """
+    if base is not None:
+        url = urljoin(base, url)
+    parsed = urlparse(url.strip())
+    path = parsed.path.rstrip("/") or "/"
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), path, "", "", ""))
+
+
+# Whitespace as HTML defines it, no-break spaces are kept
+WHITESPACE_RE = re.compile(r"[ \t\n\f\r]+")
+
+
+def _tag_name(tag):
+    return f"{tag.prefix}:{tag.name}" if tag.prefix else tag.name
+
+
+def _start_tag(tag, formatter, keep_attrs):
+    attrs = ""
+    if keep_attrs:
+        for key, val in formatter.attributes(tag):
+            if val is None:
+                attrs += f" {key}"
+                continue
+            if isinstance(val, (list, tuple)):
+                val = " ".join(val)
+            elif isinstance(val, AttributeValueWithCharsetSubstitution):
+                val = val.substitute_encoding(DEFAULT_OUTPUT_ENCODING)
+            text = formatter.attribute_value(str(val))
+            attrs += f" {key}={formatter.quoted_attribute_value(text)}"
+    if tag.is_empty_element:
+        attrs += formatter.void_element_close_prefix or ""
+    return f"<{_tag_name(tag)}{attrs}>"
+
+
+def html_without_attrs(el, deep=True, collapse_whitespace=False, drop_empty=False):
+    """HTML of `el` with the attributes of its tags left out, as `str()` renders it.
+
+    The tree is serialized in one pass, it is neither copied nor modified. Unless
+    `deep`, only the attributes of `el` itself are left out. With `collapse_whitespace`,
+    runs of whitespace in text are replaced by a single space (except inside tags
+    keeping it, like <pre>), with `drop_empty`, tags holding neither text nor a void
+    tag are left out.
+    """
+    formatter = el.formatter_for_name("minimal")
+    preserve = el.preserve_whitespace_tags or ()
+    pieces = []
+    # Open tags as [tag, index of its first piece, whether it holds any content]
+    stack = []
+    children = []
+
+    def open_tag(tag, keep_attrs):
+        if stack and tag.is_empty_element:
+            stack[-1][2] = True
+        stack.append([tag, len(pieces), tag.is_empty_element])
+        if not tag.hidden:
+            pieces.append(_start_tag(tag, formatter, keep_attrs))
+        children.append(iter(tag.contents))
+
+    def close_tag():
+        tag, start, has_content = stack.pop()
+        if drop_empty and not has_content:
+            del pieces[start:]
+            return
+        if not (tag.hidden or tag.is_empty_element):
+            pieces.append(f"</{_tag_name(tag)}>")
+        if stack and has_content:
+            stack[-1][2] = True
+
+    open_tag(el, False)
+    while children:
+        child = next(children[-1], None)
+        if child is None:
+            children.pop()
+            close_tag()
+        elif isinstance(child, Tag):
+            open_tag(child, not deep)
+        else:
+            text = child.output_ready(formatter)
+            if not isinstance(child, PreformattedString):
+                if (
+                    collapse_whitespace
+                    and type(child) is NavigableString
+                    and not any(tag.name in preserve for tag, _, _ in stack)
+                ):
+                    text = WHITESPACE_RE.sub(" ", text)
+                if not WHITESPACE_RE.fullmatch(text):
+                    stack[-1][2] = True
+            pieces.append(text)
+    return "".join(pieces)
+
+
+class RowBuffer:
+    """Accumulates rows into per-column lists, the DataFrame is built once in `to_frame`.
+
+    Missing values are stored as None.
+    With a `sink` (see `scrappers.writer`), every `chunk_size` rows are written to it and
+    dropped from the buffer, `to_frame` then holds only the rows not flushed yet.
+    """
+
+    def __init__(self, columns, sink=None, chunk_size=1000):
+        self.columns = list(columns)
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.clear()
+
+    def clear(self):
+        self._buffers = {col: [] for col in self.columns}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, row: dict):
+        for col, buffer in self._buffers.items():
+            buffer.append(row.get(col))
+        self._size += 1
+        if self.sink is not None and self._size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._size:
+            self.sink.write(self.to_frame())
+            self.clear()
+
+    def to_frame(self):
+        data = {}
+        for col, buffer in self._buffers.items():
+            data[col] = pd.Series(buffer, dtype=object)
+        return pd.DataFrame(data, columns=self.columns)
+
+
+class FieldSpec:
+    """Named css selectors, compiled once and evaluated in a single pass over a document.
+
+    All selectors are joined into one selector list, so the document is traversed once,
+    every match is then assigned to the fields whose selector it satisfies. Fields sharing
+    a selector are matched only once.
+    """
+
+    def __init__(self, selectors: dict):
+        self.selectors = dict(selectors)
+        self._compiled = {sel: sv.compile(sel) for sel in set(self.selectors.values())}
+        self._combined = sv.compile(", ".join(self._compiled))
+
+    def select(self, soup) -> dict:
+        by_selector = {sel: [] for sel in self._compiled}
+        for el in self._combined.iselect(soup):
+            for sel, pattern in self._compiled.items():
+                if pattern.match(el):
+                    by_selector[sel].append(el)
+        return {name: by_selector[sel] for name, sel in self.selectors.items()}
+
+
+def memoized(fn):
+    """Cache a Product property value (or MISSING) for the product's lifetime.
+
+    The property may return MISSING or raise NotFound if the value is not found, its
+    access raises NotFound either way. `Product.get` reads the value without raising.
+    The first evaluation is timed as `extract.<name>`, a missing value is counted as
+    `not_found.<name>`.
+    """
+    name = fn.__name__
+
+    def extract(self):
+        values = self._values
+        if name in values:
+            return values[name]
+        if self.FIELDS is not None:
+            # Time the shared selection pass on its own, not in the first field
+            self.matches
+        started = time.perf_counter()
+        try:
+            value = fn(self)
+        except NotFound:
+            value = MISSING
+        if value is MISSING:
+            metrics.count(f"not_found.{name}")
+        metrics.add_time(f"extract.{name}", time.perf_counter() - started)
+        values[name] = value
+        return value
+
+    @wraps(fn)
+    def handler(self):
+        value = extract(self)
+        if value is MISSING:
+            raise NotFound(f"{name} not found")
+        return value
+    handler.extract = extract
+    return handler
+
+
+def intern_value(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        return [intern_value(v) for v in value]
+    return value
+
+
+class Record:
+    """Compact copy of a Product's extracted values, without the soup.
+
+    Subclasses list the copied properties in `__slots__`, values of `INTERNED` properties
+    are interned. Properties that raised NotFound are left unset and raise NotFound again
+    on access, so a record can stand in for its product in an Assembler.
+    """
+    __slots__ = ("url",)
+    INTERNED = ()
+
+    _fields = frozenset(__slots__)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = cls._fields | frozenset(cls.__dict__.get("__slots__", ()))
+
+    @classmethod
+    def from_product(cls, product):
+        record = cls()
+        for field in cls._fields:
+            value = product.get(field, MISSING)
+            if value is MISSING:
+                continue
+            if field in cls.INTERNED:
+                value = intern_value(value)
+            setattr(record, field, value)
+        return record
+
+    def __getattr__(self, name):
+        if name in self._fields:
+            raise NotFound(f"{name} not found")
+        raise AttributeError(name)
+
+    def to_record(self):
+        """The record itself, so records and products are interchangeable in a run."""
+        return self
+
+    def get(self, field: str, default=None):
+        """Value of `field`, `default` if it was not found."""
+        try:
+            return object.__getattribute__(self, field)
+        except AttributeError:
+            return default
+
+    def to_state(self) -> dict:
+        """Values of the set fields as plain data, which does not refer to the class.
+
+        A record stored so can be restored by `from_state` of the same site's class,
+        however its module was imported (e.g. as `__main__`).
+        """
+        return self.__getstate__()
+
+    @classmethod
+    def from_state(cls, state: dict):
+        record = cls()
+        for field, value in state.items():
+            if field in cls.INTERNED:
+                value = intern_value(value)
+            setattr(record, field, value)
+        return record
+
+    def __getstate__(self):
+        # Unset fields are left out, so they raise NotFound again once unpickled
+        state = {}
+        for field in self._fields:
+            try:
+                state[field] = object.__getattribute__(self, field)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        for field, value in state.items():
+            setattr(self, field, value)
 
 
 class Product:
     url: str
     soup: BeautifulSoup
 
+    FIELDS: FieldSpec = None
+    RECORD = None
+
+    # Non-raising extraction of the `memoized` properties, by name
+    _extractors = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._extractors = {}
+        for name in dir(cls):
+            fget = getattr(getattr(cls, name, None), "fget", None)
+            extract = getattr(fget, "extract", None)
+            if extract is not None:
+                cls._extractors[name] = extract
+
     def __init__(self, url, soup: BeautifulSoup):
         self.url = url
         self.soup = soup
 
+        self._matches = None
+        self._values = {}
+
+    @property
+    def matches(self) -> dict:
+        """Elements matched by each `FIELDS` selector, evaluated on first access."""
+        if self._matches is None:
+            with metrics.timer("select"):
+                self._matches = self.FIELDS.select(self.soup)
+        return self._matches
+
+    def select(self, field: str):
+        return self.matches[field]
+
+    def get(self, field: str, default=None):
+        """Value of `field`, `default` if it is not found.
+
+        `memoized` properties are read without raising, others fall back to catching
+        their NotFound.
+        """
+        extract = self._extractors.get(field)
+        if extract is None:
+            try:
+                return getattr(self, field)
+            except NotFound:
+                return default
+        value = extract(self)
+        return default if value is MISSING else value
+
+    def to_record(self):
+        return self.RECORD.from_product(self)
+
+    def release(self):
+        """Drop the soup and everything matched in it."""
+        self.soup = None
+        self._matches = None
+
+
+class SkuIndex:
+    """SKU of every product by its canonical url, for resolving links between products.
+
+    Resolved links are kept as the edges of the product graph, `write_edges` exports them.
+    """
+    EDGE_COLUMNS = ["source_url", "source_sku", "relation", "target_url", "target_sku"]
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+        self.edges = []
+        self._skus = {}
+
+    def __len__(self):
+        return len(self._skus)
+
+    def add(self, url: str, sku):
+        if sku is not None and sku != "":
+            self._skus[canonical_url(url, self.base_url)] = sku
+
+    def sku(self, url: str):
+        return self._skus.get(canonical_url(url, self.base_url))
+
+    def resolve(self, source: str, relation: str, urls) -> list:
+        """SKUs of the products `source` links to by `relation`, unknown urls are skipped."""
+        source = canonical_url(source, self.base_url)
+        source_sku = self._skus.get(source)
+        skus = []
+        for url in urls:
+            url = canonical_url(url, self.base_url)
+            sku = self._skus.get(url)
+            self.edges.append((source, source_sku, relation, url, sku))
+            if sku is None:
+                logger.warning(f"Failed to resolve {relation} {url} of {source}")
+                continue
+            skus.append(sku)
+        return skus
+
+    def write_edges(self, path, kept=()):
+        """Write the links resolved so far as CSV, unresolved ones without a target SKU.
+
+        Links of the `kept` urls, products reused unchanged from the previous run, are
+        taken over from the previous file at `path` and resolved again.
+        """
+        edges = list(self.edges)
+        kept = {canonical_url(url, self.base_url) for url in kept}
+        if kept and Path(path).exists():
+            previous = pd.read_csv(path, dtype=str, keep_default_na=False)
+            for source, relation, target in zip(
+                previous["source_url"], previous["relation"], previous["target_url"]
+            ):
+                if source in kept:
+                    target_sku = self._skus.get(target)
+                    edges.append(
+                        (source, self._skus.get(source), relation, target, target_sku)
+                    )
+        pd.DataFrame(edges, columns=self.EDGE_COLUMNS).to_csv(path, index=False)
+
 
 class Assembler:
+    """Collects products into rows of their extracted values.
+
+    Rows keep the values as extracted (None if not found), `table` and `sink` get them
+    rendered to strings by `_finalize_value`, `typed_sink` as they are (see
+    `scrappers.writer.TypedParquetWriter` and `TYPES`).
+    """
     MULTIPLE_JOIN_EL = "|"
 
     INDEX = "id"
@@ -36,15 +441,108 @@ class Assembler:
         "id"
     ]
 
-    def __init__(self):
+    # Column types of the typed export, "float", "list" or "category", others are strings
+    TYPES = {}
+
+    # Products link each other by url, resolved to the product property / row column
+    SKU_FIELD = None
+    SKU_COLUMN = None
+    BASE_URL = None
+
+    def __init__(self, columns=None, compact=False, sink=None, typed_sink=None):
         self._products_url_map = {}
+        self._kept_url_map = {}
+        self._columns = columns or self.COLUMNS
+        self._compact = compact
+        self._sink = sink
+        self._typed_sink = typed_sink
+        self._sku_index = None
+        streaming = sink is not None or typed_sink is not None
+        self.rows = RowBuffer(self._columns, sink=self if streaming else None)
+
+    @property
+    def products(self):
+        return self._products_url_map.values()
+
+    @property
+    def table(self):
+        return self.render(self.rows.to_frame())
+
+    def render(self, table: pd.DataFrame) -> pd.DataFrame:
+        """Values of `table` as exported to CSV."""
+        rendered = {}
+        for col in table.columns:
+            rendered[col] = [
+                '' if value is None else self._finalize_value(value)
+                for value in table[col]
+            ]
+        return pd.DataFrame(rendered, columns=table.columns, index=table.index)
+
+    def write(self, table: pd.DataFrame):
+        """Pass rows flushed by `rows` on to the sinks."""
+        metrics.count("rows", len(table))
+        with metrics.timer("write"):
+            if self._sink is not None:
+                self._sink.write(self.render(table))
+            if self._typed_sink is not None:
+                self._typed_sink.write(table)
 
     def collect(self, product: Product):
+        """Keep the product until build, in compact mode only its Record is kept.
+
+        Records, e.g. restored by a resumed run, are kept as they are.
+        """
+        if self._compact and isinstance(product, Product):
+            record = product.to_record()
+            product.release()
+            product = record
         self._products_url_map[product.url] = product
 
+    @property
+    def sku_index(self) -> SkuIndex:
+        """Index of the collected and kept products, built on first use."""
+        if self._sku_index is None:
+            index = SkuIndex(self.BASE_URL)
+            for url, rows in self._kept_url_map.items():
+                index.add(url, self._kept_sku(rows))
+            for product in self.products:
+                index.add(product.url, product.get(self.SKU_FIELD))
+            self._sku_index = index
+        return self._sku_index
+
+    def write_edges(self, path):
+        """Write the product graph, with the links of kept products of the previous run."""
+        self.sku_index.write_edges(path, self._kept_url_map)
+
+    def _kept_sku(self, rows: list):
+        return rows[0].get(self.SKU_COLUMN)
+
+    def keep(self, url: str, rows: list):
+        """Reuse the previous run's rows of an unchanged product page, already rendered."""
+        self._kept_url_map[url] = rows
+        for row in rows:
+            self.rows.append(row)
+
     def _finalize_value(self, value):
         if isinstance(value, list):
             value = [str(v).strip() for v in value]
             value = self.MULTIPLE_JOIN_EL.join(value)
         value = str(value).strip()
         return value
+
+    def _product_row(self, product):
+        return {col: product.get(col) for col in self._columns}
+
+    def append(self, product: Product):
+        """Add the product's row right away instead of keeping the product until build."""
+        self.rows.append(self._product_row(product))
+
+    def build(self):
+        """Append the collected products to the kept rows, return the whole table."""
+        for product in self.products:
+            self.rows.append(self._product_row(product))
+        return self.table
+
+    def flush(self):
+        """Write the rows not written yet to the sinks."""
+        self.rows.flush()
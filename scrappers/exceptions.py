@@ -1,14 +1,40 @@
+from functools import wraps
+
+
 class NotFound(Exception):
     pass
 
 
+class Missing:
+    """Value of a field not found, returned by extraction instead of raising NotFound."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'MISSING'
+
+    def __reduce__(self):
+        return 'MISSING'
+
+
+MISSING = Missing()
+
+
 def get_log_wrapper(logger):
+    # NotFound is counted per field and reported once per run (see scrappers.metrics)
     def wrap_not_found(fn):
+        @wraps(fn)
         def handler(*args, **kwargs):
             try:
                 return fn(*args, **kwargs)
-            except NotFound as e:
-                logger.warning(f'{str(fn.__name__)} not found')
+            except NotFound:
                 raise
             except Exception as e:
                 logger.warning(str(e))
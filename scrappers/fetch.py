@@ -0,0 +1,175 @@
+import time
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterable, Tuple
+from urllib.parse import urlparse
+
+from scrappers.limiter import THROTTLE_STATUSES, RateLimit, RateLimiter
+from scrappers.metrics import metrics
+
+
+logger = logging.getLogger("scrappers.fetch")
+
+Fetched = namedtuple("Fetched", ["url", "context", "response", "error"])
+
+# Requests sent again after a throttling response, once the limiter's pause is over
+THROTTLE_RETRIES = 3
+
+
+def without_throttle_retries(session):
+    """Stop the adapters of `session` from retrying THROTTLE_STATUSES themselves.
+
+    Retrying them inside `session.get` sleeps for their Retry-After while holding the
+    engine's slots, and hides them from the limiter, which should back off instead.
+    """
+    for adapter in set(session.adapters.values()):
+        retry = getattr(adapter, "max_retries", None)
+        if retry is None or not retry.status_forcelist:
+            continue
+        adapter.max_retries = retry.new(
+            status_forcelist=set(retry.status_forcelist) - set(THROTTLE_STATUSES),
+            respect_retry_after_header=False,
+        )
+    return session
+
+
+class FetchEngine:
+    """Fetch urls concurrently through one session.
+
+    `max_workers` limits requests in flight globally (also across nested `map` calls),
+    `per_host` limits them per host. Requests sent out are paced per host by `limiter`
+    (see `scrappers.limiter`), fresh responses of cached sessions are not.
+    Throttling responses are left to the limiter, the session's adapters do not retry
+    them (see `without_throttle_retries`), `get` does so up to `throttle_retries` times
+    once the limiter lets it. Results are yielded in completion order.
+    `expire_after` is passed on to cached sessions only, plain sessions ignore it.
+    """
+
+    def __init__(
+        self,
+        session,
+        max_workers: int = 8,
+        per_host: int = 4,
+        rate_limit: RateLimit = RateLimit(),
+        throttle_retries: int = THROTTLE_RETRIES,
+    ):
+        self.session = without_throttle_retries(session)
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.limiter = RateLimiter(rate_limit)
+        self.throttle_retries = throttle_retries
+        self._cached = hasattr(session, "cache")
+
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, url: str):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _cached_response(self, url: str, **kwargs):
+        """Fresh cached response of `url`, None if it has to be fetched."""
+        started = time.perf_counter()
+        response = self.session.get(url, only_if_cached=True, **kwargs)
+        # requests_cache answers 504 if not cached, only 200 responses are cached
+        if response.status_code == 504 or response.is_expired:
+            return None
+        self._record(response, time.perf_counter() - started)
+        return response
+
+    def _record(self, response, seconds: float):
+        # A revalidated response comes from the cache, but only after a 304 from the host
+        revalidated = getattr(response, "revalidated", False)
+        from_cache = getattr(response, "from_cache", False) and not revalidated
+        metrics.add_time("fetch.cache" if from_cache else "fetch.network", seconds)
+        metrics.count("requests")
+        metrics.count("requests.cache_hits" if from_cache else "requests.network")
+        if revalidated:
+            metrics.count("requests.revalidated")
+        metrics.count("bytes", len(response.content))
+
+    def get(self, url: str, expire_after=None):
+        kwargs = {}
+        if self._cached:
+            if expire_after is not None:
+                kwargs["expire_after"] = expire_after
+            response = self._cached_response(url, **kwargs)
+            if response is not None:
+                return response
+
+        for attempt in range(self.throttle_retries + 1):
+            if attempt:
+                metrics.count("requests.throttle_retries")
+            response = self._send(url, **kwargs)
+            if response.status_code not in THROTTLE_STATUSES:
+                break
+        return response
+
+    def _send(self, url: str, **kwargs):
+        # Wait for the host's pace (and pause after throttling) before taking a slot,
+        # other hosts may use it meanwhile
+        self.limiter.acquire(url)
+        with self._slots, self._host_slot(url):
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, **kwargs)
+            except Exception:
+                metrics.count("requests.failed")
+                raise
+            latency = time.perf_counter() - started
+        self._record(response, latency)
+        self.limiter.feedback(url, response, latency)
+        return response
+
+    def _fetch(self, url: str, context, expire_after):
+        try:
+            return Fetched(url, context, self.get(url, expire_after), None)
+        except Exception as e:
+            return Fetched(url, context, None, e)
+
+    def map(self, items: Iterable[Tuple[str, object]], expire_after=None):
+        """Fetch `(url, context)` items, yield `Fetched` tuples as they complete.
+
+        Items are pulled lazily, so `items` may be a generator which is itself fed by
+        another `map` call.
+        """
+        items = iter(items)
+        backlog = self.max_workers * 2
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+
+            def submit():
+                for url, context in items:
+                    pending.add(
+                        executor.submit(self._fetch, url, context, expire_after)
+                    )
+                    return True
+                return False
+
+            while len(pending) < backlog and submit():
+                pass
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    submit()
+                    yield future.result()
+
+
+def check_response(fetched: Fetched, message: str = "Fetch failed"):
+    """Raise RuntimeError unless `fetched` holds a successful response."""
+    if fetched.error is not None:
+        raise RuntimeError(f"{message}: {fetched.url}") from fetched.error
+    try:
+        assert fetched.response.status_code == 200
+    except AssertionError as exc:
+        raise RuntimeError(f"{message}: {fetched.url}") from exc
+    return fetched.response
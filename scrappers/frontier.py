@@ -0,0 +1,142 @@
+import json
+import pickle
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+from scrappers.metrics import metrics
+
+logger = logging.getLogger("scrappers.frontier")
+
+DISCOVERED = "discovered"
+EXTRACTED = "extracted"
+FAILED = "failed"
+
+
+class Frontier:
+    """Crawl progress persisted in SQLite, so an interrupted run can be resumed.
+
+    Discovered items are stored per stage with their context, extracted ones with the
+    state of the product's Record (see `Record.to_state`), which does not depend on
+    the module path of the Record class, and the fingerprint of their page. Without
+    `resume` the previous progress is discarded.
+    """
+
+    def __init__(self, path, resume: bool = False):
+        self.path = Path(path)
+        if not resume:
+            # The write-ahead log would be replayed into the new database otherwise
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{self.path}{suffix}").unlink(missing_ok=True)
+
+        self._db = sqlite3.connect(self.path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " url TEXT PRIMARY KEY, stage TEXT, item TEXT, state TEXT,"
+            " record BLOB, error TEXT, fingerprint TEXT)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(items)")}
+        if "fingerprint" not in columns:
+            # Progress stored before fingerprints were
+            self._db.execute("ALTER TABLE items ADD COLUMN fingerprint TEXT")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS stages (stage TEXT PRIMARY KEY, complete INTEGER)"
+        )
+        if resume:
+            counts = dict(
+                self._db.execute("SELECT state, COUNT(*) FROM items GROUP BY state")
+            )
+            logger.info(f"Resuming from {self.path}: {counts}")
+
+    def _complete(self, stage: str) -> bool:
+        row = self._db.execute(
+            "SELECT complete FROM stages WHERE stage = ?", (stage,)
+        ).fetchone()
+        return row is not None and bool(row[0])
+
+    def items(self, stage: str, generate, key: int = 0):
+        """Items of `stage` still to be extracted, `generate()` yields them all.
+
+        Items are urls or tuples with the url at `key`. Once `generate` has been
+        exhausted, the stage is complete and later resumes read its items from the
+        frontier only.
+        """
+        if self._complete(stage):
+            rows = self._db.execute(
+                "SELECT item FROM items WHERE stage = ? AND state != ? ORDER BY rowid",
+                (stage, EXTRACTED),
+            ).fetchall()
+            logger.info(f"Stage {stage} complete, {len(rows)} items left")
+            for (item,) in rows:
+                item = json.loads(item)
+                yield item if isinstance(item, str) else tuple(item)
+            return
+
+        for item in self._timed(generate()):
+            url = item if isinstance(item, str) else item[key]
+            self._db.execute(
+                "INSERT OR IGNORE INTO items (url, stage, item, state) VALUES (?, ?, ?, ?)",
+                (url, stage, json.dumps(item), DISCOVERED),
+            )
+            (state,) = self._db.execute(
+                "SELECT state FROM items WHERE url = ?", (url,)
+            ).fetchone()
+            if state != EXTRACTED:
+                yield item
+        self._db.execute(
+            "INSERT OR REPLACE INTO stages (stage, complete) VALUES (?, 1)", (stage,)
+        )
+
+    @staticmethod
+    def _timed(items):
+        """Time spent waiting for each discovered item, i.e. crawling listings."""
+        items = iter(items)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                metrics.add_time("discover", time.perf_counter() - started)
+            metrics.count("discovered")
+            yield item
+
+    def extracted(self, url: str, record=None, fingerprint: Optional[str] = None):
+        """Mark `url` done, `record` is None for pages reused from the previous export.
+
+        `fingerprint` of the page is restored into the snapshot of a resumed run.
+        """
+        state = None if record is None else pickle.dumps(record.to_state())
+        self._db.execute(
+            "UPDATE items SET state = ?, record = ?, fingerprint = ?, error = NULL"
+            " WHERE url = ?",
+            (EXTRACTED, state, fingerprint, url),
+        )
+
+    def failed(self, url: str, error: Exception):
+        self._db.execute(
+            "UPDATE items SET state = ?, error = ? WHERE url = ?",
+            (FAILED, repr(error), url),
+        )
+
+    def restored(self, record_class):
+        """`(url, record, fingerprint)` of the items extracted before the resume.
+
+        Items are in discovery order, records are rebuilt as instances of `record_class`.
+        """
+        for url, state, fingerprint in self._db.execute(
+            "SELECT url, record, fingerprint FROM items WHERE state = ? ORDER BY rowid",
+            (EXTRACTED,),
+        ):
+            if state is None:
+                yield url, None, fingerprint
+            else:
+                yield url, record_class.from_state(pickle.loads(state)), fingerprint
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,146 @@
+import time
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+from scrappers.metrics import metrics
+
+
+logger = logging.getLogger("scrappers.limiter")
+
+# Requests per second to start at and the bounds to adapt within. Every response
+# faster than `target_latency` seconds raises the rate by `increase`, a slower one
+# lowers it by `slowdown`, a 429 / 503 by `backoff` (and pauses for its Retry-After).
+RateLimit = namedtuple(
+    "RateLimit",
+    [
+        "rate",
+        "min_rate",
+        "max_rate",
+        "target_latency",
+        "increase",
+        "slowdown",
+        "backoff",
+        "burst",
+    ],
+    defaults=[1.0, 0.05, 10.0, 2.0, 0.1, 0.9, 0.5, 1],
+)
+
+THROTTLE_STATUSES = (429, 503)
+
+
+def retry_after_seconds(response) -> Optional[float]:
+    """Seconds the Retry-After header asks to wait, in seconds or as an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        until = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=timezone.utc)
+    return max(0.0, (until - datetime.now(timezone.utc)).total_seconds())
+
+
+class HostBucket:
+    """Token bucket of one host, refilled at a rate adapted to the host's responses."""
+
+    def __init__(self, host: str, limit: RateLimit):
+        self.host = host
+        self.limit = limit
+        self.rate = limit.rate
+        self._tokens = float(limit.burst)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._refilled
+        self._tokens = min(self.limit.burst, self._tokens + elapsed * self.rate)
+        self._refilled = now
+
+    def acquire(self) -> float:
+        """Wait for a token, return the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                else:
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def feedback(self, status: int, latency: float, retry_after: Optional[float]):
+        limit = self.limit
+        with self._lock:
+            rate = self.rate
+            if status in THROTTLE_STATUSES:
+                self.rate = max(limit.min_rate, rate * limit.backoff)
+                self._tokens = 0.0
+                if retry_after:
+                    self._paused_until = time.monotonic() + retry_after
+                message = (
+                    f"{self.host} answered {status}, {rate:.2f} -> {self.rate:.2f}/s"
+                )
+                if retry_after:
+                    message += f", paused for {retry_after:.0f}s"
+                logger.info(message)
+            elif latency > limit.target_latency:
+                self.rate = max(limit.min_rate, rate * limit.slowdown)
+            else:
+                self.rate = min(limit.max_rate, rate + limit.increase)
+
+
+class RateLimiter:
+    """Token buckets per host, each adapting to its host's latency and throttling.
+
+    Hosts get the `RateLimit` they are configured with, others `default`.
+    """
+
+    def __init__(self, default: RateLimit = RateLimit()):
+        self.default = default
+        self._limits = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def configure(self, url: str, limit: RateLimit):
+        """Use `limit` for the host of `url`."""
+        host = urlparse(url).netloc
+        with self._lock:
+            self._limits[host] = limit
+            self._buckets.pop(host, None)
+
+    def bucket(self, url: str) -> HostBucket:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._buckets:
+                limit = self._limits.get(host, self.default)
+                self._buckets[host] = HostBucket(host, limit)
+            return self._buckets[host]
+
+    def acquire(self, url: str):
+        waited = self.bucket(url).acquire()
+        if waited:
+            metrics.add_time("throttle", waited)
+
+    def feedback(self, url: str, response, latency: float):
+        if response.status_code in THROTTLE_STATUSES:
+            metrics.count(f"throttled.{response.status_code}")
+        self.bucket(url).feedback(
+            response.status_code, latency, retry_after_seconds(response)
+        )
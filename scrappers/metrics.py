@@ -0,0 +1,157 @@
+import json
+import time
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+
+logger = logging.getLogger("scrappers.metrics")
+
+# Seconds between the snapshots written while a run is in progress
+SNAPSHOT_INTERVAL = 60
+# Counters of fields not found, by field name
+NOT_FOUND_PREFIX = "not_found."
+
+
+class Metrics:
+    """Timers and counters of one run, updated from any thread.
+
+    Timers are named by stage, e.g. `fetch.network`, `parse` or `extract.sku`, and keep
+    the total seconds and the number of timed calls. `start` writes snapshots to a JSON
+    file periodically, `finish` writes the final one and logs a summary, with how often
+    each field was missing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._seconds = defaultdict(float)
+        self._calls = Counter()
+        self._counters = Counter()
+        self._path = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            self._seconds[name] += seconds
+            self._calls[name] += 1
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] += n
+
+    @contextmanager
+    def timer(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def drain(self) -> dict:
+        """Take the timings and counters recorded so far, e.g. by a worker process."""
+        with self._lock:
+            drained = {
+                "seconds": dict(self._seconds),
+                "calls": dict(self._calls),
+                "counters": dict(self._counters),
+            }
+            self._seconds.clear()
+            self._calls.clear()
+            self._counters.clear()
+        return drained
+
+    def merge(self, drained: dict):
+        """Add timings and counters taken by `drain`."""
+        with self._lock:
+            for name, seconds in drained["seconds"].items():
+                self._seconds[name] += seconds
+            self._calls.update(drained["calls"])
+            self._counters.update(drained["counters"])
+
+    def missing(self) -> dict:
+        """Per field, how many times it was missing out of how many extractions.
+
+        Extractions are the calls of the field's `extract.<field>` timer, None if the
+        field is not timed.
+        """
+        missing = {}
+        with self._lock:
+            for name, count in sorted(self._counters.items()):
+                if name.startswith(NOT_FOUND_PREFIX):
+                    field = name[len(NOT_FOUND_PREFIX) :]
+                    extracted = self._calls.get(f"extract.{field}")
+                    missing[field] = {"missing": count, "extracted": extracted}
+        return missing
+
+    def snapshot(self, final: bool = False) -> dict:
+        missing = self.missing()
+        with self._lock:
+            return {
+                "elapsed": time.perf_counter() - self._started,
+                "final": final,
+                "timings": {
+                    name: {"seconds": seconds, "calls": self._calls[name]}
+                    for name, seconds in sorted(self._seconds.items())
+                },
+                "counters": dict(sorted(self._counters.items())),
+                "missing": missing,
+            }
+
+    def write(self, final: bool = False):
+        if self._path is None:
+            return
+        tmp_path = self._path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.snapshot(final), indent=2))
+        tmp_path.replace(self._path)
+
+    def start(self, path, interval: int = SNAPSHOT_INTERVAL):
+        """Write snapshots to `path` every `interval` seconds until `finish`."""
+        self._path = Path(path)
+        self._started = time.perf_counter()
+        if interval:
+            self._thread = threading.Thread(
+                target=self._write_periodically, args=(interval,), daemon=True
+            )
+            self._thread.start()
+
+    def _write_periodically(self, interval: int):
+        while not self._stop.wait(interval):
+            self.write()
+
+    def summary(self) -> str:
+        snapshot = self.snapshot(final=True)
+        lines = [f"Run took {snapshot['elapsed']:.1f}s"]
+        timings = sorted(
+            snapshot["timings"].items(), key=lambda item: -item[1]["seconds"]
+        )
+        for name, timing in timings:
+            lines.append(
+                f"  {name:<32} {timing['seconds']:>10.3f}s {timing['calls']:>8} calls"
+            )
+        for name, value in snapshot["counters"].items():
+            if not name.startswith(NOT_FOUND_PREFIX):
+                lines.append(f"  {name:<32} {value:>11}")
+        if snapshot["missing"]:
+            lines.append("Missing fields")
+        for name, counts in snapshot["missing"].items():
+            missing, extracted = counts["missing"], counts["extracted"]
+            line = f"  {name:<32} {missing:>11}"
+            if extracted:
+                line += f" of {extracted} ({missing / extracted:.0%})"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def finish(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write(final=True)
+        logger.info(self.summary())
+
+
+# Shared by the fetch engine, parsing and the products of a run
+metrics = Metrics()
@@ -1,19 +1,34 @@
+import sys
 import logging
-import time
 import copy
 import re
-import random
-import requests
 import json
-import pandas as pd
 from typing import List, Optional
 
 from bs4 import BeautifulSoup
 
+from scrappers.common import Assembler as BaseAssembler, FieldSpec, Product as BaseProduct, Record as BaseRecord, html_without_attrs
+from scrappers.cache import LISTING_EXPIRE_AFTER
+from scrappers.client import http_session
+from scrappers.fetch import FetchEngine
+from scrappers.frontier import Frontier
+from scrappers.limiter import RateLimit
+from scrappers.metrics import metrics
+from scrappers.parsing import parse, parse_html
+from scrappers.snapshot import Snapshot
+from scrappers.workers import ExtractPool, Page, collect_records, extract_records, restore_records
+from scrappers.writer import TypedParquetWriter
+
 logger = logging.getLogger('utils.millers-oil')
 logging.basicConfig(level=logging.INFO)
 
-DO_SLEEP = False
+# Crawl settings, see scrappers.workers
+RATE_LIMIT = RateLimit(rate=1.0, max_rate=5.0)
+MAX_WORKERS = 8
+MAX_PER_HOST = 4
+PARSER = 'html.parser'
+EXTRACT_PROCESSES = 0
+COMPACT_RECORDS = True
 
 MULTIPLE_JOIN_EL = '|'
 ESHOP_NAME = 'millers_oils_cz'
@@ -42,12 +57,83 @@ COLUMNS_MAP = [
 ]
 COLUMNS = [col for _, col in COLUMNS_MAP]
 COLUMNS.append(VAR_PARENT)
+TYPES = {
+    'product_sales': 'float',
+    'product_override_price': 'float',
+    'file_url': 'list',
+    'related_products': 'list',
+    'typ': 'list',
+    'category_name': 'list',
+    'objem': 'list',
+}
 VAR_PROPS = ['product_sku', 'product_sales',
              'product_override_price', 'volume_list']
 
 
-class Product:
-    soup: BeautifulSoup
+class Record(BaseRecord):
+    __slots__ = (
+        'product_sku',
+        'product_name',
+        'product_s_desc',
+        'product_desc',
+        'product_override_price',
+        'product_sales',
+        'type_list',
+        'volume_list',
+        'profile',
+        'characteristic',
+        'additional_info',
+        'category_list',
+        'image_url_list',
+        'related_product_url_list',
+        'related_product_sku_list',
+        'variants_data',
+    )
+    INTERNED = ('type_list', 'volume_list', 'category_list')
+
+    def to_state(self):
+        state = super().to_state()
+        if state.get('variants_data') is not None:
+            state['variants_data'] = [vars(var) for var in state['variants_data']]
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        record = super().from_state(state)
+        if record.get('variants_data') is not None:
+            variants = []
+            for values in record.variants_data:
+                var = Product.Variant()
+                vars(var).update(values)
+                variants.append(var)
+            record.variants_data = variants
+        return record
+
+
+class Product(BaseProduct):
+    RECORD = Record
+    FIELDS = FieldSpec({
+        'variations': '.variations_form.cart',
+        'sku': '.sku',
+        'name': '.product_title',
+        'short_desc': '.description',
+        'desc': '#tab-description',
+        'override_price': '.product-essential .price del .amount',
+        'sales_price': '.product-essential .price ins .amount',
+        'price': '.price .amount',
+        'type': '.tagged_as a',
+        'category': '.posted_in a',
+        'volume': '.description span.label',
+        'tabs': '.woocommerce-tabs > ul > li',
+        'images': '.thumbnails .attachment-shop_thumbnail',
+        'related': '.product-row .product > div > a',
+    })
+    VARIANT_PRICE_FIELDS = FieldSpec({
+        'override_price': '.price del .amount',
+        'sales_price': '.price ins .amount',
+        'price': '.price .amount',
+    })
+    TAB_LABELS = ['VÝKONOVÝ PROFIL', 'CHARAKTERISTIKA', 'Další informace']
 
     product_sku: int
     product_name: str
@@ -78,8 +164,7 @@ class Product:
     variants_data: Optional[List[Variant]] = None
 
     def __init__(self, url, soup: BeautifulSoup):
-        self.url = url
-        self.soup = soup
+        super().__init__(url, soup)
 
         self.variants_data = self._parse_variants_data()
 
@@ -91,30 +176,28 @@ class Product:
         if self.variants_data is None:
             self.volume_list = self._parse_volume_list()
             self.product_override_price = self._prase_product_override_price(
-                self.soup)
-            self.product_sales = self._prase_product_sales(self.soup)
+                self.matches)
+            self.product_sales = self._prase_product_sales(self.matches)
         else:
             self.volume_list = None
             self.product_override_price = None
             self.product_sales = None
 
         self.type_list = self._parse_type()
-        self.profile = self._parse_profile()
-        self.characteristic = self._parse_characteristic()
-        self.additional_info = self._parse_additional_info()
+        tabs = self._parse_tabs()
+        self.profile = self._parse_tab(tabs, 'VÝKONOVÝ PROFIL')
+        self.characteristic = self._parse_tab(tabs, 'CHARAKTERISTIKA')
+        self.additional_info = self._parse_tab(tabs, 'Další informace')
 
         self.category_list = self._parse_category_name()
         self.image_url_list = self._parse_image_url_list()
         self.related_product_url_list = self._parse_related_product_url_list()
         self.related_product_sku_list = []
 
-    def assign_related_product_sku_list(self, rp_sku: list):
-        self.related_product_sku_list = rp_sku
-
     def _parse_variants_data(self):
         variants = []
         try:
-            raw = json.loads(self.soup.css.select('.variations_form.cart')[
+            raw = json.loads(self.select('variations')[
                              0]['data-product_variations'])
         except (ValueError, IndexError, KeyError) as exc:
             return None
@@ -123,44 +206,41 @@ class Product:
             if raw_var['variation_is_visible']:
                 var = self.Variant()
                 var.product_sku = int(raw_var['sku'])
-                price_html = BeautifulSoup(
-                    raw_var['price_html'], 'html.parser')
+                price_html = self.VARIANT_PRICE_FIELDS.select(parse_html(
+                    raw_var['price_html'], PARSER))
                 var.product_override_price = self._prase_product_override_price(
-                    price_html, False)
+                    price_html)
                 var.product_sales = self._prase_product_sales(
-                    price_html, False)
+                    price_html)
                 var.volume_list = [raw_var['attributes']['attribute_pa_objem']]
                 variants.append(var)
         return variants
 
     def _parse_sku(self):
         try:
-            return int(self.soup.css.select('.sku')[0].text)
+            return int(self.select('sku')[0].text)
         except (ValueError, IndexError) as exc:
             raise RuntimeError('SKU not found') from exc
 
     def _parse_name(self):
         try:
-            return self.soup.css.select('.product_title')[0].text
+            return self.select('name')[0].text
         except IndexError as exc:
             raise RuntimeError('Product name not found') from exc
 
     def _parse_short_desc(self):
-        desc = self.soup.css.select('.description')
+        desc = self.select('short_desc')
         if len(desc):
-            el = self._remove_attrs(desc[0])
-            return str(el)
+            return html_without_attrs(desc[0], deep=False)
 
     def _parse_desc(self):
-        desc = self.soup.css.select('#tab-description')
+        desc = self.select('desc')
         if len(desc):
-            el = self._remove_attrs(desc[0])
-            return str(el)
+            return html_without_attrs(desc[0], deep=False)
 
-    def _prase_product_override_price(self, soup, whole_page=True):
-        scope = ".product-essential" if whole_page else ''
+    def _prase_product_override_price(self, matches):
         try:
-            price = soup.css.select(f'{scope} .price del .amount')[0].text
+            price = matches['override_price'][0].text
         except IndexError:
             return None
 
@@ -172,13 +252,12 @@ class Product:
 
         return price
 
-    def _prase_product_sales(self, soup, whole_page=True):
-        scope = ".product-essential" if whole_page else ''
+    def _prase_product_sales(self, matches):
         try:
-            price = soup.css.select(f'{scope} .price ins .amount')[0].text
+            price = matches['sales_price'][0].text
         except IndexError as exc:
             try:
-                price = soup.css.select('.price .amount')[0].text
+                price = matches['price'][0].text
             except IndexError as exc:
                 raise RuntimeError('Product price not found') from exc
 
@@ -191,109 +270,58 @@ class Product:
         return price
 
     def _parse_type(self):
-        return [el.text for el in self.soup.css.select('.tagged_as a')]
+        return [el.text for el in self.select('type')]
 
     def _parse_category_name(self):
-        return [el.text for el in self.soup.css.select('.posted_in a')]
+        return [el.text for el in self.select('category')]
 
     def _parse_volume_list(self):
-        return [el.text.replace('objem', '') for el in self.soup.css.select('.description span.label')]
-
-    def _parse_profile(self):
-        uid = None
-        tabs = self.soup.css.select('.woocommerce-tabs > ul > li')
-        for tab in tabs:
-            if 'VÝKONOVÝ PROFIL' in tab.text:
-                uid = tab.get('aria-controls')
+        return [el.text.replace('objem', '') for el in self.select('volume')]
+
+    def _parse_tabs(self):
+        uids = {}
+        for tab in self.select('tabs'):
+            text = tab.text
+            for label in self.TAB_LABELS:
+                if label in text:
+                    uids[label] = tab.get('aria-controls')
+        return uids
+
+    def _parse_tab(self, uids, label):
+        uid = uids.get(label)
         if uid is None:
-            logger.warning(f'[{self.url}] VÝKONOVÝ PROFIL not found')
+            logger.warning(f'[{self.url}] {label} not found')
             return ''
-        content = self.soup.css.select(f'div#{uid}')
-        if len(content):
-            el = self._remove_attrs(content[0])
-            return str(el)
-
-    def _parse_characteristic(self):
-        uid = None
-        tabs = self.soup.css.select('.woocommerce-tabs > ul > li')
-        for tab in tabs:
-            if 'CHARAKTERISTIKA' in tab.text:
-                uid = tab.get('aria-controls')
-        if uid is None:
-            logger.warning(f'[{self.url}] CHARAKTERISTIKA not found')
-            return ''
-        content = self.soup.css.select(f'div#{uid}')
-        if len(content):
-            el = self._remove_attrs(content[0])
-            return str(el)
-
-    def _parse_additional_info(self):
-        uid = None
-        tabs = self.soup.css.select('.woocommerce-tabs > ul > li')
-        for tab in tabs:
-            if 'Další informace' in tab.text:
-                uid = tab.get('aria-controls')
-        if uid is None:
-            logger.warning(f'[{self.url}] Další informace not found')
-            return ''
-        content = self.soup.css.select(f'div#{uid}')
-        if len(content):
-            el = self._remove_attrs(content[0])
-            return str(el)
+        content = self.soup.find('div', id=uid)
+        if content is not None:
+            return html_without_attrs(content, deep=False)
 
     def _parse_image_url_list(self):
-        imgs = [el.get('src') for el in self.soup.css.select(
-            '.thumbnails .attachment-shop_thumbnail')]
+        imgs = [el.get('src') for el in self.select('images')]
         imgs = [re.sub(ESHOP_IMAGE_URL_RE, '.', img) for img in imgs]
         return imgs
 
     def _parse_related_product_url_list(self):
-        return [el.get('href') for el in self.soup.css.select('.product-row .product > div > a')]
-
-    def _remove_attrs(self, el, deep=True):
-        el = copy.copy(el)
-        keys = list(el.attrs.keys())
-        for attr in keys:
-            del el[attr]
-
-        if deep:
-            tag_list = el.findAll(lambda tag: len(tag.attrs) > 0)
-            for t in tag_list:
-                self._remove_attrs(t, False)
-        return el
+        return [el.get('href') for el in self.select('related')]
 
+class Assembler(BaseAssembler):
+    SKU_FIELD = 'product_sku'
+    SKU_COLUMN = INDEX
+    BASE_URL = 'https://www.millers-oils.cz'
 
-class Assembler:
-    def __init__(self, index, columns, mapping):
-        self._table = pd.DataFrame(columns=columns, index=[index]).dropna()
-        self._products_url_map = {}
+    def __init__(self, index, columns, mapping, compact=False, sink=None, typed_sink=None):
+        super().__init__(columns, compact=compact, sink=sink, typed_sink=typed_sink)
 
         self._index = index
         self._mapping = mapping
         self._mapping_dict = dict(mapping)
 
-    @property
-    def table(self):
-        return self._table
-
-    @property
-    def products(self):
-        return self._products_url_map.values()
-
-    def collect(self, product: Product):
-        self._products_url_map[product.url] = product
+    def _kept_sku(self, rows):
+        # Rows of variants hold the product's sku as their parent
+        return rows[0].get(VAR_PARENT) or rows[0][INDEX]
 
     def _resolve_related_products(self, product: Product):
-        related_sku_list = []
-        for rp_url in product.related_product_url_list:
-            try:
-                rp = self._products_url_map[rp_url]
-            except KeyError:
-                logger.warning(
-                    f'Failed to resolve related product with url: {rp_url} for {product.url}')
-            else:
-                related_sku_list.append(rp.product_sku)
-        return related_sku_list
+        return self.sku_index.resolve(product.url, 'related', product.related_product_url_list)
 
     def _finalize_value(self, value):
         if isinstance(value, float):
@@ -307,16 +335,15 @@ class Assembler:
     def add(self, product: Product):
         product_dict = {}
 
-        rp_sku = self._resolve_related_products(product)
-        product.assign_related_product_sku_list(rp_sku)
+        product.related_product_sku_list = self._resolve_related_products(product)
 
         for prop, col in self._mapping:
             value = getattr(product, prop)
             if value is not None:
-                value = self._finalize_value(value)
                 product_dict[col] = value
             elif not (product.variants_data is not None and prop in VAR_PROPS):
-                logger.info(f'[{product.url}] {prop} not found')
+                logger.debug(f'[{product.url}] {prop} not found')
+                metrics.count(f'not_found.{prop}')
 
         if product.variants_data is not None:
             logger.info(f'[{product.url}] variants detected')
@@ -327,18 +354,27 @@ class Assembler:
                     col = self._mapping_dict[prop]
                     value = getattr(var, prop)
                     if value is not None:
-                        value = self._finalize_value(value)
                         var_dict[col] = value
                     else:
-                        logger.info(
+                        logger.debug(
                             f'[{product.url} variants] {prop} not found')
+                        metrics.count(f'not_found.{prop}')
                 var_dict[VAR_PARENT] = parent
-                row = pd.DataFrame(var_dict, index=[self._index])
-                self._table = pd.concat([self._table, row], ignore_index=True)
+                self.rows.append(var_dict)
 
         else:
-            row = pd.DataFrame(product_dict, index=[self._index])
-            self._table = pd.concat([self._table, row], ignore_index=True)
+            self.rows.append(product_dict)
+
+
+# Set by `use_engine`, `main` creates the site's own if not given one
+engine: Optional[FetchEngine] = None
+
+
+def use_engine(shared: FetchEngine):
+    """Fetch through `shared` instead of the site's own engine."""
+    global engine
+    shared.limiter.configure(ESHOP_URL_TEMPLATE, RATE_LIMIT)
+    engine = shared
 
 
 def product_url_generator(template: str):
@@ -347,7 +383,7 @@ def product_url_generator(template: str):
         content_url = template.format(page=page)
 
         logger.info(f'Fetching content: {content_url}')
-        response = requests.get(content_url)
+        response = engine.get(content_url, expire_after=LISTING_EXPIRE_AFTER)
         try:
             assert response.status_code == 200
         except AssertionError as exc:
@@ -356,42 +392,55 @@ def product_url_generator(template: str):
         else:
             logger.info(f'Fetch success')
             page += 1
-            if DO_SLEEP:
-                cooldown = random.randint(5, 20)
-                logger.info(f'Sleep: {cooldown}')
-                time.sleep(cooldown)
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = parse(response, PARSER)
         for url in [a.get('href') for a in soup.css.select('.product > div > a')]:
             yield url
 
 
-def product_processing(url: str) -> Product:
-    response = requests.get(url)
-    try:
-        assert response.status_code == 200
-    except AssertionError as exc:
-        raise RuntimeError(f'Product fetch failed: {url}') from exc
+def extract_page(page: Page) -> Product:
+    soup = parse(page, PARSER)
+    with metrics.timer('extract'):
+        return Product(page.url, soup)
+
 
-    soup = BeautifulSoup(response.content, 'html.parser')
-    return Product(url, soup)
+def product_records(urls, snapshot: Snapshot = None, pool: ExtractPool = None):
+    """Fetch and extract product urls through the site's engine, see `extract_records`."""
+    return extract_records(engine, ((url, None) for url in urls), extract_page, snapshot, pool)
 
 
 LIMIT = None
+
+
+def main(resume: bool = False, engine: FetchEngine = None):
+    """Crawl the eshop into results/, `resume` continues an interrupted run.
+
+    `engine` replaces the site's fetch engine, e.g. to share one across sites.
+    """
+    if engine is None:
+        engine = FetchEngine(http_session(), max_workers=MAX_WORKERS, per_host=MAX_PER_HOST,
+                             rate_limit=RATE_LIMIT)
+    use_engine(engine)
+    frontier = Frontier(f'results/{ESHOP_NAME}.frontier.sqlite', resume=resume)
+    snapshot = Snapshot(f'results/{ESHOP_NAME}.csv', sku_column=INDEX)
+    typed = TypedParquetWriter(f'results/{ESHOP_NAME}.parquet', COLUMNS, TYPES)
+    assembler = Assembler(INDEX, COLUMNS, COLUMNS_MAP, compact=COMPACT_RECORDS, sink=snapshot, typed_sink=typed)
+    restore_records(frontier, snapshot, assembler, assembler.collect, Record)
+    pool = ExtractPool(extract_page, EXTRACT_PROCESSES) if EXTRACT_PROCESSES else None
+    items = frontier.items('products', lambda: product_url_generator(ESHOP_URL_TEMPLATE))
+    collect_records(product_records(items, snapshot, pool), frontier, snapshot, assembler, assembler.collect, LIMIT)
+    with metrics.timer('assemble'):
+        for product in assembler.products:
+            assembler.add(product)
+        assembler.flush()
+    assembler.write_edges(f'results/{ESHOP_NAME}-edges.csv')
+    if pool is not None:
+        pool.close()
+    snapshot.close()
+    typed.close()
+    frontier.close()
+
+
 if __name__ == '__main__':
-    count = 0
-    assembler = Assembler(INDEX, COLUMNS, COLUMNS_MAP)
-    for url in product_url_generator(ESHOP_URL_TEMPLATE):
-        # url = 'https://www.millers-oils.cz/shop/prevodove-oleje/prevodovy-plne-synteticky-olej-millers-oils-crx-ls-75w90-nt/'
-        if LIMIT is not None and count == LIMIT:
-            break
-        count += 1
-        try:
-            product = product_processing(url)
-        except RuntimeError as exc:
-            logger.error(url)
-            logger.exception(exc)
-            continue
-        assembler.collect(product)
-    for product in assembler.products:
-        assembler.add(product)
-    assembler.table.to_csv(f"results/{ESHOP_NAME}.csv")
+    metrics.start(f'results/{ESHOP_NAME}.metrics.json')
+    main(resume='--resume' in sys.argv[1:])
+    metrics.finish()
@@ -0,0 +1,78 @@
+"""Run several scrappers together through one fetch engine and HTTP cache.
+
+`python -m scrappers.orchestrator [site ...] [--resume]` runs all sites by default.
+Each site crawls in its own thread, the shared engine limits requests in flight per
+host and in total, so waiting on one host leaves room for the others.
+"""
+
+import sys
+import time
+import logging
+import argparse
+import importlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from scrappers.cache import cached_session, expire_legacy_responses
+from scrappers.fetch import FetchEngine
+from scrappers.metrics import metrics
+
+
+logger = logging.getLogger("scrappers.orchestrator")
+
+SITES = ["antiradary", "millers_oils", "schoeffel", "ziener"]
+SESSION_NAME = "portfolio"
+# Requests in flight across all sites, and per host
+MAX_WORKERS = 16
+MAX_PER_HOST = 4
+
+
+def run_site(site: str, engine: FetchEngine, resume: bool) -> float:
+    module = importlib.import_module(f"scrappers.{site}.main")
+    started = time.perf_counter()
+    module.main(resume=resume, engine=engine)
+    return time.perf_counter() - started
+
+
+def run(sites, resume: bool = False) -> int:
+    """Crawl `sites` concurrently, return the number of sites that failed."""
+    session = cached_session(SESSION_NAME)
+    expire_legacy_responses(session.cache)
+    engine = FetchEngine(session, max_workers=MAX_WORKERS, per_host=MAX_PER_HOST)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=len(sites)) as executor:
+        futures = {
+            executor.submit(run_site, site, engine, resume): site for site in sites
+        }
+        for future in as_completed(futures):
+            site = futures[future]
+            try:
+                elapsed = future.result()
+            except Exception:
+                logger.exception(f"{site} failed")
+                failed += 1
+            else:
+                logger.info(f"{site} done in {elapsed:.0f}s")
+    return failed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument(
+        "sites", nargs="*", metavar="site", help=f"one of {', '.join(SITES)}, or all"
+    )
+    arg_parser.add_argument("--resume", action="store_true")
+    args = arg_parser.parse_args()
+    unknown = set(args.sites) - set(SITES)
+    if unknown:
+        arg_parser.error(f"unknown sites: {', '.join(sorted(unknown))}")
+
+    metrics.start(f"results/{SESSION_NAME}.metrics.json")
+    failed = run(args.sites or SITES, args.resume)
+    metrics.finish()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -1,22 +1,34 @@
 import re
-import time
-import random
+import sys
 import logging
-import requests_cache
-import pandas as pd
-
-from bs4 import BeautifulSoup
-
-from scrappers.common import Assembler as BaseAssembler, Product as BaseProduct
-from scrappers.exceptions import NotFound, get_log_wrapper
+from typing import List
+
+from scrappers.common import Assembler as BaseAssembler, FieldSpec, Product as BaseProduct, Record as BaseRecord, memoized
+from scrappers.exceptions import MISSING, get_log_wrapper
+from scrappers.cache import LISTING_EXPIRE_AFTER, cached_session, expire_legacy_responses
+from scrappers.fetch import FetchEngine, check_response
+from scrappers.frontier import Frontier
+from scrappers.limiter import RateLimit
+from scrappers.metrics import metrics
+from scrappers.parsing import parse
+from scrappers.snapshot import Snapshot
+from scrappers.workers import ExtractPool, Page, collect_records, extract_records, restore_records
+from scrappers.writer import TypedParquetWriter
 
 ESHOP_NAME = 'schoeffel'
+SESSION_NAME = 'production-18-02-2024'
+# SESSION_NAME = 'development'
 
 
 logger = logging.getLogger(ESHOP_NAME)
 logging.basicConfig(level=logging.INFO)
 
-DO_SLEEP = False
+# Crawl settings, see scrappers.workers
+RATE_LIMIT = RateLimit(rate=1.0, max_rate=5.0)
+MAX_WORKERS = 8
+MAX_PER_HOST = 4
+PARSER = "html.parser"
+EXTRACT_PROCESSES = 0
 
 ESHOP_URLS = [['https://www.schoeffel.com/de/de/damen', 43],
               ['https://www.schoeffel.com/de/de/herren', 38],
@@ -34,81 +46,107 @@ def normalize_text(text):
     return text
 
 
+class Record(BaseRecord):
+    __slots__ = (
+        "parent_url",
+        "sku",
+        "color",
+        "color_code",
+        "product_name",
+        "product_description",
+        "product_material",
+        "images"
+    )
+    INTERNED = ("parent_url", "color", "color_code", "product_material")
+
+
 class Product(BaseProduct):
-    parent_url: str
+    RECORD = Record
+    FIELDS = FieldSpec({
+        'active_color': '#article-wrapper section.headline div.filter.color-wrapper a.active',
+        'product_name': '#article-wrapper section.headline div.content > div > div > h2',
+        'product_description': '#article-description',
+        'product_material': '#article-material',
+        'images': '.main-slider img',
+    })
+
+    parent_url: str = None
 
     sku_re = re.compile(r'(?<=Modellnummer\s)(\d+-\d+)')
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def sku(self):
-        desc = self.product_description_text
+        desc = self.get('product_description_text')
         if not desc:
-            raise NotFound()
+            return MISSING
 
         m = self.sku_re.search(desc)
         if m is None:
-            raise NotFound()
+            return MISSING
 
         return m.group(0)
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def color(self):
-        try:
-            return self.soup.css.select(
-                '#article-wrapper section.headline div.filter.color-wrapper a.active')[0].get('title')
-        except Exception as e:
-            raise NotFound() from e
+        found = self.select('active_color')
+        if not found:
+            return MISSING
+        return found[0].get('title')
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def color_code(self):
-        try:
-            return self.soup.css.select(
-                '#article-wrapper section.headline div.filter.color-wrapper a.active')[0].get('data-color-number')
-        except Exception as e:
-            raise NotFound() from e
+        found = self.select('active_color')
+        if not found:
+            return MISSING
+        return found[0].get('data-color-number')
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def product_name(self):
-        try:
-            return self.soup.css.select('#article-wrapper section.headline div.content > div > div > h2')[0].text
-        except Exception as e:
-            raise NotFound() from e
+        found = self.select('product_name')
+        if not found:
+            return MISSING
+        return found[0].text
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def product_description(self):
-        try:
-            return normalize_text(self.soup.css.select('#article-description')[0].get_text())
-        except Exception as e:
-            raise NotFound() from e
+        found = self.select('product_description')
+        if not found:
+            return MISSING
+        return normalize_text(found[0].get_text())
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def product_description_text(self):
-        try:
-            return self.soup.css.select('#article-description')[0].text
-        except Exception as e:
-            raise NotFound() from e
+        found = self.select('product_description')
+        if not found:
+            return MISSING
+        return found[0].text
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def product_material(self):
-        try:
-            return normalize_text(self.soup.css.select('#article-material')[0].get_text())
-        except Exception as e:
-            raise NotFound() from e
+        found = self.select('product_material')
+        if not found:
+            return MISSING
+        return normalize_text(found[0].get_text())
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def images(self):
-        try:
-            return [im.get('src') for im in self.soup.css.select('.main-slider img')]
-        except Exception as e:
-            raise NotFound() from e
+        return [im.get('src') for im in self.select('images')]
 
 
 class Assembler(BaseAssembler):
@@ -124,125 +162,118 @@ class Assembler(BaseAssembler):
         "product_material",
         "images"
     ]
+    TYPES = {
+        "color": "category",
+        "product_material": "category",
+        "images": "list",
+    }
 
-    def exist(self, url):
-        return url in self._products_url_map
-
-    def build(self):
-        table = pd.DataFrame(columns=self.COLUMNS, index=[self.INDEX]).dropna()
-        for product in self._products_url_map.values():
-            product_dict = {}
-            for col in self.COLUMNS:
-                try:
-                    value = getattr(product, col)
-                except NotFound:
-                    value = ''
-                else:
-                    value = self._finalize_value(value)
 
-                product_dict[col] = value
-
-            row = pd.DataFrame(product_dict, index=[self.INDEX])
-            table = pd.concat([table, row], ignore_index=True)
-        return table
+def extract_page(page: Page) -> Product:
+    """Product of a fetched variant page with its parent url as context."""
+    product = Product(page.url, parse(page, PARSER))
+    product.parent_url = page.context
+    return product
 
 
 class Workflow:
-    session = requests_cache.CachedSession('production-18-02-2024')
-    # session = requests_cache.CachedSession('development')
+    # Set by `use_engine`, `main` opens the site's own session if not given one
+    session = None
+    engine: FetchEngine = None
 
     collected = set()
 
     @staticmethod
-    def url_generator(base_url: str, pages: int) -> str:
-        for page in range(pages):
-            logger.info(f'Page: {page} / {pages}')
-            page_url = f'{base_url}?page={page + 1}'
-            for product_url in Workflow._url_generator_product(page_url):
-                for variant_url in Workflow._url_generator_variant(product_url):
-                    yield product_url, variant_url
+    def use_engine(engine: FetchEngine):
+        """Fetch through `engine` and its session instead of the site's own."""
+        engine.limiter.configure(ESHOP_URLS[0][0], RATE_LIMIT)
+        Workflow.session = engine.session
+        Workflow.engine = engine
 
     @staticmethod
-    def _url_generator_product(url: str) -> str:
-        response = Workflow.session.get(url)
-
-        try:
-            assert response.status_code == 200
-        except AssertionError:
-            logger.info(f"Fetch failed: {url}")
-            raise StopIteration()
-        else:
-            if DO_SLEEP:
-                cooldown = random.randint(5, 20)
-                logger.info(f"Sleep: {cooldown}")
-                time.sleep(cooldown)
-
-        soup = BeautifulSoup(response.content, "html.parser")
-        for a in soup.css.select(".article-item .article-wrapper div.image-wrapper > a"):
-            yield a.get('href')
+    def url_generator(base_url: str, pages: int) -> str:
+        page_urls = [f'{base_url}?page={page + 1}' for page in range(pages)]
+        product_urls = Workflow._url_generator_product(page_urls)
+        for product_url, variant_url in Workflow._url_generator_variant(product_urls):
+            if variant_url in Workflow.collected:
+                continue
+            Workflow.collected.add(variant_url)
+            yield product_url, variant_url
 
     @staticmethod
-    def _url_generator_variant(url: str) -> str:
-        response = Workflow.session.get(url)
-
-        try:
-            assert response.status_code == 200
-        except AssertionError:
-            logger.info(f"Fetch failed: {url}")
-            raise StopIteration()
-        else:
-            if DO_SLEEP:
-                cooldown = random.randint(5, 20)
-                logger.info(f"Sleep: {cooldown}")
-                time.sleep(cooldown)
-
-        soup = BeautifulSoup(response.content, "html.parser")
-        for a in soup.css.select("#article-wrapper .filter.color-wrapper a"):
-            yield a.get('href')
+    def _url_generator_product(urls: List[str]) -> str:
+        items = ((url, None) for url in urls)
+        for fetched in Workflow.engine.map(items, expire_after=LISTING_EXPIRE_AFTER):
+            logger.info(f'Page: {fetched.url}')
+            try:
+                response = check_response(fetched)
+            except RuntimeError as e:
+                logger.info(str(e))
+                continue
+
+            soup = parse(response, PARSER)
+            for a in soup.css.select(".article-item .article-wrapper div.image-wrapper > a"):
+                yield a.get('href')
 
     @staticmethod
-    def url_collector(url: str) -> Product:
-        response = Workflow.session.get(url)
-        try:
-            assert response.status_code == 200
-        except AssertionError as exc:
-            raise RuntimeError(f"Product fetch failed: {url}") from exc
+    def _url_generator_variant(urls) -> str:
+        for fetched in Workflow.engine.map(((url, None) for url in urls)):
+            try:
+                response = check_response(fetched)
+            except RuntimeError as e:
+                logger.info(str(e))
+                continue
 
-        soup = BeautifulSoup(response.content, "html.parser")
-        return Product(url, soup)
+            soup = parse(response, PARSER)
+            for a in soup.css.select("#article-wrapper .filter.color-wrapper a"):
+                yield fetched.url, a.get('href')
 
 
 LIMIT = None
-if __name__ == "__main__":
+
+
+def main(resume: bool = False, engine: FetchEngine = None):
+    """Crawl the eshop into results/, `resume` continues an interrupted run.
+
+    `engine` replaces the site's fetch engine, e.g. to share one across sites.
+    """
+    if engine is None:
+        session = cached_session(SESSION_NAME)
+        expire_legacy_responses(session.cache)
+        engine = FetchEngine(session, max_workers=MAX_WORKERS, per_host=MAX_PER_HOST, rate_limit=RATE_LIMIT)
+    Workflow.use_engine(engine)
     count = 0
 
-    assembler = Assembler()
+    snapshot = Snapshot(f"results/{ESHOP_NAME}/{ESHOP_NAME}-18-02-24-full.csv", index=False)
+    # snapshot = Snapshot(f"results/{ESHOP_NAME}/{ESHOP_NAME}-sample-10.csv", index=False)
+    frontier = Frontier(f"results/{ESHOP_NAME}/{ESHOP_NAME}.frontier.sqlite", resume=resume)
+    typed = TypedParquetWriter(
+        f"results/{ESHOP_NAME}/{ESHOP_NAME}-18-02-24-full.parquet", Assembler.COLUMNS, Assembler.TYPES)
+    assembler = Assembler(sink=snapshot, typed_sink=typed)
+    pool = ExtractPool(extract_page, EXTRACT_PROCESSES) if EXTRACT_PROCESSES else None
+    restore_records(frontier, snapshot, assembler, assembler.append, Record)
     for base_url, pages in ESHOP_URLS:
         logger.info(f'Collecting: {base_url}')
-        for parent_url, variant_url in Workflow.url_generator(base_url, pages):
-
-            if assembler.exist(variant_url):
-                continue
-
-            count += 1
-            if count and count % 100 == 0:
-                logger.info(f'Count: {count}')
-            try:
-                product = Workflow.url_collector(variant_url)
-            except Exception as e:
-                logger.error(variant_url)
-                logger.exception(e)
-                continue
-            product.parent_url = parent_url
-            assembler.collect(product)
-            if LIMIT is not None and count == LIMIT:
-                break
+        items = frontier.items(
+            base_url, lambda: Workflow.url_generator(base_url, pages), key=1)
+        items = ((variant_url, parent_url) for parent_url, variant_url in items)
+        results = extract_records(Workflow.engine, items, extract_page, snapshot, pool)
+        count += collect_records(
+            results, frontier, snapshot, assembler, assembler.append, None if LIMIT is None else LIMIT - count)
         if LIMIT is not None and count == LIMIT:
             break
 
     logger.info(f'Collected: {count} products')
 
-    table = assembler.build()
-    table.to_csv(
-        f"results/{ESHOP_NAME}/{ESHOP_NAME}-18-02-24-full.csv", index=False)
-    # f"results/{ESHOP_NAME}/{ESHOP_NAME}-sample-10.csv", index=False)
+    assembler.flush()
+    if pool is not None:
+        pool.close()
+    snapshot.close()
+    typed.close()
+    frontier.close()
+
+
+if __name__ == "__main__":
+    metrics.start(f"results/{ESHOP_NAME}/{ESHOP_NAME}.metrics.json")
+    main(resume="--resume" in sys.argv[1:])
+    metrics.finish()
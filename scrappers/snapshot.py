@@ -0,0 +1,152 @@
+import os
+import json
+import hashlib
+import logging
+from collections import Counter
+from pathlib import Path
+
+import pandas as pd
+
+from scrappers.writer import CsvWriter, open_writer, read_table
+
+
+logger = logging.getLogger("scrappers.snapshot")
+
+# Yielded by the product generators instead of a product for unchanged pages
+UNCHANGED = object()
+
+
+def fingerprint(content: bytes, context=None) -> str:
+    """Fingerprint of a fetched page body and the listing context it was found with."""
+    digest = hashlib.blake2b(content, digest_size=16)
+    if context is not None:
+        digest.update(repr(context).encode())
+    return digest.hexdigest()
+
+
+class Snapshot:
+    """Full export of the previous run and the fingerprints of its product pages.
+
+    Pages with an unchanged fingerprint are not extracted again, their previous rows
+    are reused. Tables passed to `write` are streamed to `<stem>.partial<suffix>` (CSV,
+    `.csv.gz` or `.parquet`), their added and changed rows to `<stem>-delta.csv`.
+    `close` moves the export to `path`, adds the removed rows to the delta and stores the
+    fingerprints in `<stem>.fingerprints.json`. Until then, the previous export is kept.
+    Rows are matched on their `url` and `sku` columns.
+    """
+
+    CHANGE_COLUMN = "change"
+    SUFFIXES = (".csv.gz", ".csv", ".parquet")
+
+    def __init__(self, path, url_column="url", sku_column="sku", index=True):
+        self.path = Path(path)
+        stem, suffix = str(self.path), ""
+        for known in self.SUFFIXES:
+            if stem.endswith(known):
+                stem, suffix = stem[: -len(known)], known
+                break
+        self.partial_path = Path(f"{stem}.partial{suffix}")
+        self.delta_path = Path(f"{stem}-delta.csv")
+        self.fingerprints_path = Path(f"{stem}.fingerprints.json")
+        self.url_column = url_column
+        self.sku_column = sku_column
+        self.index = index
+
+        self.previous = {}
+        self._previous_url_rows = {}
+        if self.path.exists():
+            for row in read_table(self.path, index=index).to_dict("records"):
+                self.previous[self._key(row)] = row
+                self._previous_url_rows.setdefault(row[url_column], []).append(row)
+
+        self._fingerprints = {}
+        if self.fingerprints_path.exists() and self.previous:
+            self._fingerprints = json.loads(self.fingerprints_path.read_text())
+        self._next_fingerprints = {}
+
+        self._written = set()
+        self._counts = Counter()
+        self._columns = None
+        self._writer = None
+        self._delta_writer = None
+
+    def unchanged(self, url: str, content: bytes, context=None) -> bool:
+        """Record the page's fingerprint, True if the previous run exported it as is."""
+        value = fingerprint(content, context)
+        self._next_fingerprints[url] = value
+        return self._fingerprints.get(url) == value and url in self._previous_url_rows
+
+    def page_fingerprint(self, url: str):
+        """Fingerprint recorded for the page at `url` in this run, None if not fetched."""
+        return self._next_fingerprints.get(url)
+
+    def keep_fingerprint(self, url: str, value: str):
+        """Store `value` for a page fetched before a resume, it is not fetched again."""
+        self._next_fingerprints[url] = value
+
+    def rows(self, url: str) -> list:
+        """Previous rows exported for the page at `url`."""
+        return self._previous_url_rows[url]
+
+    def _key(self, row: dict):
+        return row[self.url_column], row[self.sku_column]
+
+    def _write_delta(self, rows: list, columns):
+        if not rows:
+            return
+        if self._delta_writer is None:
+            self._delta_writer = CsvWriter(self.delta_path)
+        self._delta_writer.write(
+            pd.DataFrame(rows, columns=[self.CHANGE_COLUMN, *columns])
+        )
+        self._counts.update(row[self.CHANGE_COLUMN] for row in rows)
+
+    def write(self, table: pd.DataFrame):
+        """Append `table` to the full export and its added or changed rows to the delta."""
+        if self._writer is None:
+            self._writer = open_writer(self.partial_path, index=self.index)
+            self._columns = list(table.columns)
+        self._writer.write(table)
+
+        values = table.astype(object).where(table.notna(), "").astype(str)
+        rows = []
+        for row in values.to_dict("records"):
+            key = self._key(row)
+            self._written.add(key)
+            previous = self.previous.get(key)
+            if previous is None:
+                rows.append({self.CHANGE_COLUMN: "added", **row})
+            elif any(row[col] != previous.get(col, "") for col in row):
+                rows.append({self.CHANGE_COLUMN: "changed", **row})
+        self._write_delta(rows, table.columns)
+
+    def close(self):
+        """Finish the delta with the rows not written in this run, store fingerprints."""
+        if self._writer is None:
+            logger.info("Nothing exported, previous export is kept")
+            return
+        self._writer.close()
+        os.replace(self.partial_path, self.path)
+
+        removed = [
+            {self.CHANGE_COLUMN: "removed", **row}
+            for key, row in self.previous.items()
+            if key not in self._written
+        ]
+        self._write_delta(removed, self._columns)
+        if self._delta_writer is None:
+            pd.DataFrame(columns=[self.CHANGE_COLUMN, *self._columns]).to_csv(
+                self.delta_path, index=False
+            )
+        else:
+            self._delta_writer.close()
+        self.fingerprints_path.write_text(json.dumps(self._next_fingerprints))
+
+        logger.info(
+            f"Delta of {len(self._written)} rows: "
+            + (", ".join(f"{c} {n}" for c, n in self._counts.items()) or "none")
+        )
+
+    def export(self, table: pd.DataFrame):
+        self.write(table)
+        self.close()
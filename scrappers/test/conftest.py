@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The scrappers are imported as `scrappers.<module>` from the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
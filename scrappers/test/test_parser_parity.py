@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import pytest
+from requests.models import Response
+
+from scrappers.benchmarks.extraction import (
+    FIXTURES_DIR,
+    KEY_FIELDS,
+    load_corpus,
+    load_site,
+)
+from scrappers.benchmarks.parser_parity import mismatches
+from scrappers.common import Record
+from scrappers.parsing import DEFAULT_PARSER, PARSERS
+
+OTHER_PARSERS = [parser for parser in PARSERS if parser != DEFAULT_PARSER]
+
+
+@pytest.mark.parametrize("parser", OTHER_PARSERS)
+@pytest.mark.parametrize("site", sorted(KEY_FIELDS))
+def test_parser_extracts_as_default_parser(site, parser):
+    corpus = FIXTURES_DIR / site
+    if not (corpus / "manifest.json").exists():
+        pytest.skip(
+            f"no stored pages of {site}, export them with benchmarks.extraction"
+        )
+
+    responses = [response for _, response in load_corpus(corpus)]
+    found = list(mismatches(load_site(site), responses, parser))
+
+    assert not found, "\n".join(
+        f"{url} {field}: {expected!r} != {actual!r}"
+        for url, field, expected, actual in found
+    )
+
+
+@pytest.mark.parametrize("parser", OTHER_PARSERS)
+def test_mismatches_reports_differing_fields(parser):
+    class PageRecord(Record):
+        __slots__ = ("title", "builder")
+
+    class Product:
+        RECORD = PageRecord
+
+        def __init__(self, url, soup):
+            self.url = url
+            self.title = soup.title.string
+            self.builder = soup.builder.NAME
+
+    response = Response()
+    response.status_code = 200
+    response.url = "https://example.com/product"
+    response.headers["content-type"] = "text/html; charset=utf-8"
+    response._content = b"<html><head><title>Product</title></head></html>"
+
+    found = list(mismatches(SimpleNamespace(Product=Product), [response], parser))
+
+    assert [(url, field) for url, field, _, _ in found] == [(response.url, "builder")]
@@ -0,0 +1,228 @@
+"""Fetching, extracting and collecting the product pages of a site.
+
+Site modules (`scrappers.<site>.main`) configure their crawl with:
+
+- `RATE_LIMIT`: pace of requests to the eshop, adapted to its responses (see
+  `scrappers.limiter`), `MAX_WORKERS` and `MAX_PER_HOST` limit requests in flight.
+- `PARSER`: tree builder of the pages, lxml once `scrappers.benchmarks.parser_parity`
+  finds no mismatches on the site's stored pages.
+- `EXTRACT_PROCESSES`: worker processes parsing and extracting product pages, 0
+  extracts in the main process.
+"""
+
+import os
+import logging
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterable, Optional, Tuple
+
+from scrappers.fetch import FetchEngine, check_response
+from scrappers.metrics import metrics
+from scrappers.snapshot import UNCHANGED, Snapshot
+
+logger = logging.getLogger("scrappers.workers")
+
+
+class Page(namedtuple("Page", ["url", "content", "headers", "context"])):
+    """A fetched page as sent to a worker process, `parse` takes it like a response."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_response(cls, url: str, response, context=None):
+        headers = {"content-type": response.headers.get("content-type", "")}
+        return cls(url, response.content, headers, context)
+
+
+def _init_worker(initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def extract_record(extract: Callable[[Page], object], page: Page):
+    """Record of the Product `extract(page)` returns, the exception if that failed."""
+    try:
+        product = extract(page)
+        record = product.to_record()
+        product.release()
+    except Exception as e:
+        return e
+    return record
+
+
+def _extract(extract, page: Page):
+    return extract_record(extract, page), metrics.drain()
+
+
+class ExtractPool:
+    """Parses fetched pages and extracts their Records in worker processes.
+
+    `extract(page)` returns the Product of a `Page`, it is pickled by reference, so it
+    must be a module level function. Workers are spawned, `initializer(*initargs)` sets
+    up what they do not import, e.g. class attributes loaded at run time. Timings and
+    counters of the workers are merged into `scrappers.metrics`.
+    """
+
+    def __init__(
+        self,
+        extract: Callable[[Page], object],
+        processes: Optional[int] = None,
+        initializer: Optional[Callable] = None,
+        initargs: tuple = (),
+    ):
+        self.extract = extract
+        self.processes = processes or os.cpu_count()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(initializer, initargs),
+        )
+
+    def map(self, items: Iterable[Tuple[str, object]]):
+        """Extract the pages of `(url, page)` items, yield `(url, record)` as completed.
+
+        Items which are not a `Page`, e.g. fetch errors or `UNCHANGED`, are passed
+        through. A failed extraction yields its exception instead of the record.
+        """
+        items = iter(items)
+        backlog = self.processes * 2
+        pending = {}
+
+        while True:
+            while len(pending) < backlog:
+                item = next(items, None)
+                if item is None:
+                    break
+                url, page = item
+                if isinstance(page, Page):
+                    future = self._executor.submit(_extract, self.extract, page)
+                    pending[future] = url
+                else:
+                    yield url, page
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = pending.pop(future)
+                try:
+                    result, drained = future.result()
+                except Exception as e:
+                    # The worker died or the result did not pickle
+                    yield url, e
+                    continue
+                metrics.merge(drained)
+                yield url, result
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def fetch_pages(
+    engine: FetchEngine,
+    items: Iterable[Tuple[str, object]],
+    snapshot: Optional[Snapshot] = None,
+):
+    """Fetch `(url, context)` items concurrently, yield `(url, page)` as completed.
+
+    For failed urls `page` is the exception, for pages unchanged since `snapshot` (with
+    the same context) it is `UNCHANGED`.
+    """
+    for fetched in engine.map(items):
+        try:
+            response = check_response(fetched, "Product fetch failed")
+        except RuntimeError as e:
+            yield fetched.url, e
+            continue
+        if snapshot is not None and snapshot.unchanged(
+            fetched.url, response.content, fetched.context
+        ):
+            yield fetched.url, UNCHANGED
+            continue
+        yield fetched.url, Page.from_response(fetched.url, response, fetched.context)
+
+
+def extract_records(
+    engine: FetchEngine,
+    items: Iterable[Tuple[str, object]],
+    extract: Callable[[Page], object],
+    snapshot: Optional[Snapshot] = None,
+    pool: Optional[ExtractPool] = None,
+):
+    """Fetch `(url, context)` items and extract their pages, yield `(url, record)`.
+
+    Pages are extracted by `pool` if given, by `extract` in this process otherwise,
+    either way a failed fetch or extraction yields its exception instead of the record
+    and pages unchanged since `snapshot` yield `UNCHANGED`.
+    """
+    pages = fetch_pages(engine, items, snapshot)
+    if pool is not None:
+        yield from pool.map(pages)
+        return
+    for url, page in pages:
+        if isinstance(page, Page):
+            page = extract_record(extract, page)
+        yield url, page
+
+
+def restore_records(
+    frontier, snapshot: Snapshot, assembler, add: Callable, record_class
+):
+    """Pass the records extracted before a resume to `add`, e.g. `assembler.collect`.
+
+    Pages reused from the previous export keep their rows, the fingerprints of all
+    restored pages are stored in `snapshot` as if they were fetched in this run.
+    """
+    for url, record, value in frontier.restored(record_class):
+        if value is not None:
+            snapshot.keep_fingerprint(url, value)
+        if record is None:
+            assembler.keep(url, snapshot.rows(url))
+        else:
+            add(record)
+
+
+def collect_records(
+    results: Iterable[Tuple[str, object]],
+    frontier,
+    snapshot: Snapshot,
+    assembler,
+    add: Callable,
+    limit: Optional[int] = None,
+) -> int:
+    """Store the `(url, record)` results of `extract_records`, return how many there were.
+
+    Records are passed to `add`, e.g. `assembler.collect`, and stored in `frontier`.
+    Unchanged pages keep their previous rows, failures are logged. Stops after `limit`
+    results.
+    """
+    count = 0
+    for url, record in results:
+        if limit is not None and count == limit:
+            break
+        count += 1
+        if count % 100 == 0:
+            logger.info(f"Count: {count}")
+
+        if isinstance(record, Exception):
+            logger.error(f"Failed: {url}", exc_info=record)
+            frontier.failed(url, record)
+            metrics.count("products.failed")
+        elif record is UNCHANGED:
+            assembler.keep(url, snapshot.rows(url))
+            frontier.extracted(url, None, snapshot.page_fingerprint(url))
+            metrics.count("products.unchanged")
+        else:
+            frontier.extracted(url, record, snapshot.page_fingerprint(url))
+            with metrics.timer("assemble"):
+                add(record)
+            metrics.count("products.extracted")
+    return count
@@ -0,0 +1,161 @@
+import gzip
+from pathlib import Path
+
+import pandas as pd
+
+
+class CsvWriter:
+    """Appends tables to a CSV file, gzip compressed if `path` ends with `.gz`.
+
+    The header is written with the first table. With `index`, the written index counts
+    rows across all tables, as if the whole table was written at once.
+    """
+
+    def __init__(self, path, index: bool = False):
+        self.path = Path(path)
+        self.index = index
+        self.rows_written = 0
+        if self.path.suffix == ".gz":
+            self._file = gzip.open(self.path, "wt", newline="")
+        else:
+            self._file = open(self.path, "w", newline="")
+
+    def write(self, table: pd.DataFrame):
+        if self.index:
+            table = table.set_axis(
+                pd.RangeIndex(self.rows_written, self.rows_written + len(table))
+            )
+        table.to_csv(self._file, header=self.rows_written == 0, index=self.index)
+        self._file.flush()
+        self.rows_written += len(table)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetWriter:
+    """Appends tables to a Parquet file, one row group per table."""
+
+    def __init__(self, path, index: bool = False):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Parquet output requires pyarrow") from e
+
+        self._pa, self._pq = pa, pq
+        self.path = Path(path)
+        self.index = index
+        self.rows_written = 0
+        self._writer = None
+
+    def write(self, table: pd.DataFrame):
+        if self.index:
+            table = table.set_axis(
+                pd.RangeIndex(self.rows_written, self.rows_written + len(table))
+            )
+        if self._writer is None:
+            schema = self._pa.Schema.from_pandas(table, preserve_index=self.index)
+            # Columns empty in the first table would be typed null, values are strings
+            for i, field in enumerate(schema):
+                if field.type == self._pa.null():
+                    schema = schema.set(i, field.with_type(self._pa.string()))
+            self._writer = self._pq.ParquetWriter(self.path, schema)
+        arrow_table = self._pa.Table.from_pandas(
+            table, schema=self._writer.schema, preserve_index=self.index
+        )
+        self._writer.write_table(arrow_table)
+        self.rows_written += len(table)
+
+    def close(self):
+        if self._writer is None:
+            # Nothing written, leave no file behind
+            return
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TypedParquetWriter(ParquetWriter):
+    """Appends tables of extracted values to a Parquet file with typed columns.
+
+    `types` maps columns to "float" (float64), "list" (list of strings) or "category"
+    (dictionary encoded strings), other columns are strings. Values rendered already,
+    e.g. rows reused from a CSV export, are parsed back, lists split on `join_el`.
+    Lists in other columns are joined on `join_el`, as in the CSV export.
+    """
+
+    def __init__(self, path, columns, types: dict, join_el: str = "|"):
+        super().__init__(path)
+        pa = self._pa
+        self.types = types
+        self.join_el = join_el
+        arrow_types = {
+            "float": pa.float64(),
+            "list": pa.list_(pa.string()),
+            "category": pa.dictionary(pa.int32(), pa.string()),
+        }
+        self.schema = pa.schema(
+            [(col, arrow_types.get(types.get(col), pa.string())) for col in columns]
+        )
+
+    def _value(self, kind, value):
+        if value is None or value == "":
+            return None
+        if kind == "float":
+            if isinstance(value, str):
+                return float(value.replace(",", "."))
+            return float(value)
+        if kind == "list":
+            if isinstance(value, str):
+                return value.split(self.join_el)
+            return [str(v).strip() for v in value]
+        if isinstance(value, list):
+            # Joined as rendered for the CSV, so kept and extracted rows are alike
+            return self.join_el.join(str(v).strip() for v in value)
+        return str(value).strip()
+
+    def write(self, table: pd.DataFrame):
+        pa = self._pa
+        arrays = []
+        for field in self.schema:
+            kind = self.types.get(field.name)
+            values = [self._value(kind, value) for value in table[field.name]]
+            if kind == "category":
+                arrays.append(pa.array(values, pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, field.type))
+
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, self.schema)
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.rows_written += len(table)
+
+
+def open_writer(path, index: bool = False):
+    """Streaming writer for `path`, `.parquet` files get row groups, others CSV rows."""
+    if Path(path).suffix == ".parquet":
+        return ParquetWriter(path, index=index)
+    return CsvWriter(path, index=index)
+
+
+def read_table(path, index: bool = False) -> pd.DataFrame:
+    """Read a table written by `open_writer` back, all values as strings."""
+    if Path(path).suffix == ".parquet":
+        table = pd.read_parquet(path)
+        if not index:
+            table = table.reset_index(drop=True)
+        return table.astype(object).where(table.notna(), "").astype(str)
+    return pd.read_csv(
+        path, dtype=str, keep_default_na=False, index_col=0 if index else None
+    )
@@ -1,66 +1,111 @@
 import re
-import time
-import random
+import sys
+import json
 import logging
-import requests_cache
-import pandas as pd
-from bs4 import BeautifulSoup
+import soupsieve as sv
 from typing import List
+from pathlib import Path
 
-
-from scrappers.common import Assembler as BaseAssembler, Product as BaseProduct
-from scrappers.exceptions import NotFound, get_log_wrapper
+from scrappers.common import Assembler as BaseAssembler, FieldSpec, Product as BaseProduct, Record as BaseRecord, memoized
+from scrappers.exceptions import MISSING, get_log_wrapper
+from scrappers.cache import LISTING_EXPIRE_AFTER, STATIC_EXPIRE_AFTER, cached_session, expire_legacy_responses
+from scrappers.fetch import FetchEngine, check_response
+from scrappers.frontier import Frontier
+from scrappers.limiter import RateLimit
+from scrappers.metrics import metrics
+from scrappers.parsing import parse
+from scrappers.snapshot import Snapshot
+from scrappers.workers import ExtractPool, Page, collect_records, extract_records, restore_records
+from scrappers.writer import TypedParquetWriter
 
 
 logger = logging.getLogger("ziener")
 logging.basicConfig(level=logging.INFO)
 
-DO_SLEEP = False
+# Crawl settings, see scrappers.workers
+RATE_LIMIT = RateLimit(rate=1.0, max_rate=5.0)
+MAX_WORKERS = 8
+MAX_PER_HOST = 4
+PARSER = "html.parser"
+EXTRACT_PROCESSES = 0
 
 ESHOP_NAME = 'ziener'
 ESHOP_URL = 'https://ziener.com'
+SESSION_NAME = 'production-27-12-2023'
+# SESSION_NAME = 'development'
 
 BASE_URL = ['https://ziener.com/en', ['winter', 'summer']]
 
+CSS_COLOR_RE = re.compile(r'icon-colors_([^\s:]+)::after\s(?=({.*}))')
+
+
+class Record(BaseRecord):
+    __slots__ = (
+        "sku",
+        "product_name",
+        "colors",
+        "color_codes",
+        "product_description",
+        "product_material",
+        "images"
+    )
+    INTERNED = ("colors", "color_codes", "product_material")
+
 
 class Product(BaseProduct):
+    RECORD = Record
+    FIELDS = FieldSpec({
+        'product_name': 'article > div > div > div > h1',
+        'info_rows': '#pills-info tr',
+        'product_description': '#features-home',
+        'color_variants': '#pills-farben #detail_name',
+        'product_material': '#pills-technologie',
+        'images': 'article div.slider_detail_produkt figure a',
+    })
+    info_label_sel = sv.compile('td:nth-child(1)')
+    info_value_sel = sv.compile('td:nth-child(2)')
+    color_icon_sel = sv.compile('[class^="icon-colors"]')
 
     css_colors_url = "https://ziener.com/templates/ziener/css/nagel.werbeagentur.css"
-    css_colors_content = None
+    css_colors = {}
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def product_name(self):
-        try:
-            return self.soup.css.select('article > div > div > div > h1')[0].text
-        except Exception as e:
-            raise NotFound() from e
+        found = self.select('product_name')
+        if not found:
+            return MISSING
+        return found[0].text
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def sku(self):
-        try:
-            for r in self.soup.css.select('#pills-info tr'):
-                if r.css.select('td:nth-child(1)')[0].text == 'Item No.':
-                    return r.css.select('td:nth-child(2)')[0].text
-        except Exception as e:
-            raise NotFound() from e
-        raise NotFound()
+        for r in self.select('info_rows'):
+            label = self.info_label_sel.select_one(r)
+            if label is not None and label.text == 'Item No.':
+                value = self.info_value_sel.select_one(r)
+                if value is not None:
+                    return value.text
+        return MISSING
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def product_description(self):
-        try:
-            return str(self.soup.css.select('#features-home')[0])
-        except Exception as e:
-            raise NotFound() from e
+        found = self.select('product_description')
+        if not found:
+            return MISSING
+        return str(found[0])
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def color_codes(self):
         codes = []
-        for e in self.soup.css.select('#pills-farben #detail_name'):
-            cs = e.css.select('[class^="icon-colors"]')
+        for e in self.select('color_variants'):
+            cs = self.color_icon_sel.select(e)
             var_codes = []
             for c in cs:
                 c = [cl for cl in c.get('class') if 'icon-colors' in cl]
@@ -72,6 +117,7 @@ class Product(BaseProduct):
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def colors(self):
         codes = self.color_codes
         colors = []
@@ -85,34 +131,40 @@ class Product(BaseProduct):
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def product_material(self):
-        try:
-            return str(self.soup.css.select('#pills-technologie')[0])
-        except Exception as e:
-            raise NotFound() from e
+        found = self.select('product_material')
+        if not found:
+            return MISSING
+        return str(found[0])
 
     @property
     @get_log_wrapper(logger)
+    @memoized
     def images(self):
-        try:
-            return [a.get('href') for a in self.soup.css.select('article div.slider_detail_produkt figure a')]
-        except Exception as e:
-            raise NotFound() from e
+        return [a.get('href') for a in self.select('images')]
 
     def _get_color_name(self, code):
-        exp = re.compile(f'(?<=icon-colors_{code}' + r'::after\s){.*}')
-        m = exp.search(self.css_colors_content)
-        if m is None:
-            return 'unknown'
-        else:
-            color = m.group(0)
-            color = color.replace('{', '')
-            color = color.replace('}', '')
-            color = color.replace('content:', '')
-            color = color.replace('"', '')
-            color = color.replace(';', '')
-            color = color.strip()
-            return color
+        return self.css_colors.get(code, 'unknown')
+
+
+def parse_css_colors(content: str) -> dict:
+    """Map color codes to names from the `.icon-colors_<code>::after {content: "<name>"}` rules.
+
+    The lookahead keeps overlapping rules on one (minified) line matchable, the first rule
+    of a code wins.
+    """
+    colors = {}
+    for m in CSS_COLOR_RE.finditer(content):
+        color = m.group(2)
+        color = color.replace('{', '')
+        color = color.replace('}', '')
+        color = color.replace('content:', '')
+        color = color.replace('"', '')
+        color = color.replace(';', '')
+        color = color.strip()
+        colors.setdefault(m.group(1), color)
+    return colors
 
 
 class Assembler(BaseAssembler):
@@ -127,47 +179,67 @@ class Assembler(BaseAssembler):
         "product_material",
         "images"
     ]
+    TYPES = {
+        "colors": "list",
+        "color_codes": "list",
+        "product_material": "category",
+        "images": "list",
+    }
 
-    def build(self):
-        table = pd.DataFrame(columns=self.COLUMNS, index=[self.INDEX]).dropna()
-        for product in self._products_url_map.values():
-            product_dict = {}
-            for col in self.COLUMNS:
-                try:
-                    value = getattr(product, col)
-                except NotFound:
-                    value = ''
-                else:
-                    value = self._finalize_value(value)
 
-                product_dict[col] = value
+def extract_page(page: Page) -> Product:
+    return Product(page.url, parse(page, PARSER))
 
-            row = pd.DataFrame(product_dict, index=[self.INDEX])
-            table = pd.concat([table, row], ignore_index=True)
-        return table
+
+def init_worker(css_colors: dict):
+    Product.css_colors = css_colors
 
 
 class Workflow:
-    session = requests_cache.CachedSession('production-27-12-2023')
-    # session = requests_cache.CachedSession('development')
+    # Set by `use_engine`, `main` opens the site's own session if not given one
+    session = None
+    engine: FetchEngine = None
+
+    @staticmethod
+    def use_engine(engine: FetchEngine):
+        """Fetch through `engine` and its session instead of the site's own."""
+        engine.limiter.configure(ESHOP_URL, RATE_LIMIT)
+        Workflow.session = engine.session
+        Workflow.engine = engine
 
     @staticmethod
     def init_css_content():
-        response = Workflow.session.get(Product.css_colors_url)
+        """Load the color index persisted next to the session cache.
+
+        The stylesheet is always requested, which is cheap while it is cached. The index
+        is rebuilt when the stylesheet was fetched anew, i.e. it is not from the cache or
+        its ETag (or when it was cached) differs from the one the index was built from.
+        """
+        index_path = Path(Workflow.session.cache.db_path).with_suffix('.colors.json')
+        response = Workflow.session.get(Product.css_colors_url, expire_after=STATIC_EXPIRE_AFTER)
         assert response.status_code == 200
 
-        Product.css_colors_content = response.content.decode('utf-8')
+        created_at = getattr(response, 'created_at', None)
+        version = response.headers.get('ETag') or (created_at and created_at.isoformat())
+        if getattr(response, 'from_cache', False) and index_path.exists():
+            index = json.loads(index_path.read_text())
+            if isinstance(index, dict) and index.get('version') == version:
+                Product.css_colors = index['colors']
+                return
+
+        Product.css_colors = parse_css_colors(response.content.decode('utf-8'))
+        index_path.write_text(json.dumps({'version': version, 'colors': Product.css_colors}))
 
     @staticmethod
     def url_generator(base_url: str, sections: List[str]) -> str:
-        response = Workflow.session.get(base_url)
+        response = Workflow.session.get(base_url, expire_after=LISTING_EXPIRE_AFTER)
         try:
             assert response.status_code == 200
         except AssertionError:
             logger.info(f"Fetch failed: {base_url}")
             raise RuntimeError()
 
-        soup = BeautifulSoup(response.content, "html.parser")
+        soup = parse(response, PARSER)
 
         category_urls = []
         for section in sections:
@@ -176,68 +248,65 @@ class Workflow:
                     for a in tile.parent.css.select('.dropdown-menu ul li ul.last-level li > a'):
                         category_urls.append(f"{ESHOP_URL}/{a.get('href')}")
 
-        for category_url in category_urls:
-            for product_url in Workflow._url_generator_product(category_url):
-                yield f'{ESHOP_URL}/{product_url}'
+        for product_url in Workflow._url_generator_product(category_urls):
+            yield f'{ESHOP_URL}/{product_url}'
 
     @staticmethod
-    def _url_generator_product(url: str) -> str:
-        response = Workflow.session.get(url)
+    def _url_generator_product(urls: List[str]) -> str:
+        items = ((url, None) for url in urls)
+        for fetched in Workflow.engine.map(items, expire_after=LISTING_EXPIRE_AFTER):
+            try:
+                response = check_response(fetched)
+            except RuntimeError as e:
+                logger.info(str(e))
+                continue
 
-        try:
-            assert response.status_code == 200
-        except AssertionError:
-            logger.info(f"Fetch failed: {url}")
-            raise StopIteration()
-        else:
-            if DO_SLEEP:
-                cooldown = random.randint(5, 20)
-                logger.info(f"Sleep: {cooldown}")
-                time.sleep(cooldown)
-
-        soup = BeautifulSoup(response.content, "html.parser")
-        for a in soup.css.select("article figure > a"):
-            yield a.get('href')
+            soup = parse(response, PARSER)
+            for a in soup.css.select("article figure > a"):
+                yield a.get('href')
 
-    @staticmethod
-    def url_collector(url: str) -> Product:
-        response = Workflow.session.get(url)
-        try:
-            assert response.status_code == 200
-        except AssertionError as exc:
-            raise RuntimeError(f"Product fetch failed: {url}") from exc
 
-        soup = BeautifulSoup(response.content, "html.parser")
-        return Product(url, soup)
+LIMIT = None
 
 
-LIMIT = None
-if __name__ == "__main__":
-    count = 0
+def main(resume: bool = False, engine: FetchEngine = None):
+    """Crawl the eshop into results/, `resume` continues an interrupted run.
+
+    `engine` replaces the site's fetch engine, e.g. to share one across sites.
+    """
+    if engine is None:
+        session = cached_session(SESSION_NAME)
+        expire_legacy_responses(session.cache)
+        engine = FetchEngine(session, max_workers=MAX_WORKERS, per_host=MAX_PER_HOST, rate_limit=RATE_LIMIT)
+    Workflow.use_engine(engine)
 
-    assembler = Assembler()
+    frontier = Frontier(f"results/{ESHOP_NAME}/{ESHOP_NAME}.frontier.sqlite", resume=resume)
+    snapshot = Snapshot(f"results/{ESHOP_NAME}/{ESHOP_NAME}-27-12-23-full.csv", index=False)
+    typed = TypedParquetWriter(
+        f"results/{ESHOP_NAME}/{ESHOP_NAME}-27-12-23-full.parquet", Assembler.COLUMNS, Assembler.TYPES)
+    assembler = Assembler(sink=snapshot, typed_sink=typed)
+    restore_records(frontier, snapshot, assembler, assembler.append, Record)
     base_url, sections = BASE_URL
 
     Workflow.init_css_content()
-    for product_url in Workflow.url_generator(base_url, sections):
-        logger.info(f'URL: {product_url}')
+    pool = None
+    if EXTRACT_PROCESSES:
+        pool = ExtractPool(extract_page, EXTRACT_PROCESSES, init_worker, (Product.css_colors,))
+    items = frontier.items('products', lambda: Workflow.url_generator(base_url, sections))
+    results = extract_records(Workflow.engine, ((url, None) for url in items), extract_page, snapshot, pool)
+    count = collect_records(results, frontier, snapshot, assembler, assembler.append, LIMIT)
 
-        count += 1
-        if count and count % 100 == 0:
-            logger.info(f'Count: {count}')
+    logger.info(f'Collected: {count} products')
 
-        try:
-            product = Workflow.url_collector(product_url)
-        except Exception as e:
-            logger.error(product_url)
-            logger.exception(e)
-            continue
-        assembler.collect(product)
-        if LIMIT is not None and count == LIMIT:
-            break
+    assembler.flush()
+    if pool is not None:
+        pool.close()
+    snapshot.close()
+    typed.close()
+    frontier.close()
 
-    logger.info(f'Collected: {count} products')
 
-    table = assembler.build()
-    table.to_csv(
-        f"results/{ESHOP_NAME}/{ESHOP_NAME}-27-12-23-full.csv", index=False)
+if __name__ == "__main__":
+    metrics.start(f"results/{ESHOP_NAME}/{ESHOP_NAME}.metrics.json")
+    main(resume="--resume" in sys.argv[1:])
+    metrics.finish()
@@ -1,27 +1,50 @@
+import time
 import logging
 import azure.functions as func
 
-from manager import Manager
+from manager import Manager, reset_clients
 
 app = func.FunctionApp()
 
+# Invocations served by this instance, the first one is the cold start
+invocations = 0
+
 
 @app.function_name(name="realitymarket")
 @app.timer_trigger(schedule="0 */15 * * * *", arg_name="timer", run_on_startup=True)
 def main(timer: func.TimerRequest) -> None:
+    global invocations
+    invocations += 1
+
     logging.getLogger("azure").setLevel(logging.WARNING)
     logging.basicConfig(level=logging.INFO)
 
+    timings = {}
+    started = time.perf_counter()
+
     manager = Manager()
+    timings["clients"] = time.perf_counter() - started
     e = "Failed to collect market changes"
 
     try:
         new_offer_detected, collection_failed, offers = manager.identify_new_offers()
+        timings["collect"] = time.perf_counter() - started - timings["clients"]
         if new_offer_detected:
             manager.report_new_offers(offers)
     except Exception as e:
+        # Deferred like the other Azure SDK imports, see manager._create_clients
+        from azure.core.exceptions import ClientAuthenticationError
+
+        if isinstance(e, ClientAuthenticationError):
+            reset_clients()
         manager.report_failure(str(e))
         raise
+    finally:
+        timings["total"] = time.perf_counter() - started
+        logging.info(
+            f"Invocation {invocations} ({'cold' if invocations == 1 else 'warm'}): "
+            + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items())
+        )
 
     if collection_failed:
         manager.report_failure(e)
@@ -1,12 +1,8 @@
 import os
+import time
 import logging
-import hashlib
-
-from azure.data.tables import TableServiceClient
-from azure.core.credentials import AzureNamedKeyCredential
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
-from azure.eventgrid import EventGridPublisherClient, EventGridEvent
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from parsers.bazos import (
     list_offers as bazos_list_offers,
@@ -20,6 +16,8 @@ from parsers.sreality import (
     list_offers as sreality_list_offers,
     fetch_offer_by_url as sreality_offer_by_url,
 )
+from storage import row_key, query_existing_row_keys, insert_row_keys
+from seen import SeenOffers, DEFAULT_SNAPSHOT_PATH
 
 
 KEY_VALUT_URL = os.environ["KEY_VALUT_URL"]
@@ -30,6 +28,13 @@ EVENTGRID_TOPIC_ENDPOINT = os.environ["EVENTGRID_TOPIC_ENDPOINT"]
 
 verbose_publish = os.environ.get("VERBOSE_PUBLISH") == "1"
 
+# Detail pages fetched in parallel per domain
+DETAIL_FETCH_CONCURRENCY = int(os.environ.get("DETAIL_FETCH_CONCURRENCY", "4"))
+# Credential, secret and clients are reused by warm invocations until they expire
+CLIENTS_TTL_SECONDS = int(os.environ.get("CLIENTS_TTL_SECONDS", "3600"))
+# Offers known to be stored are remembered locally, only the others are looked up
+SEEN_OFFERS_SNAPSHOT = os.environ.get("SEEN_OFFERS_SNAPSHOT", DEFAULT_SNAPSHOT_PATH)
+
 # TODO: this should be configured per user
 BAZOS_FILTER_QUERY = "?hledat=&rubriky=reality&hlokalita=76901&humkreis=40&cenaod=&cenado=&Submit=Hledat&order=&crp=&kitx=ano"
 FACEBOOK_FILTER_QUERY = (
@@ -38,53 +43,167 @@ FACEBOOK_FILTER_QUERY = (
 SREALITY_FILTER_QUERY = "?region=Hole%C5%A1ov&region-id=3125&region-typ=municipality&vzdalenost=25&stari=dnes"
 
 
+def _create_clients():
+    # Azure SDK imports are deferred, so they only cost on the first (cold) invocation
+    from azure.data.tables import TableServiceClient
+    from azure.core.credentials import AzureNamedKeyCredential
+    from azure.identity import DefaultAzureCredential
+    from azure.keyvault.secrets import SecretClient
+    from azure.eventgrid import EventGridPublisherClient
+
+    default_az_credential = DefaultAzureCredential()
+    secret_client = SecretClient(
+        vault_url=KEY_VALUT_URL, credential=default_az_credential
+    )
+    table_storage_key = secret_client.get_secret(TABLE_STORAGE_KEY_SECRET_NAME)
+    table_service_client = TableServiceClient(
+        endpoint=f"https://{TABLE_STORAGE_NAME}.table.core.windows.net",
+        credential=AzureNamedKeyCredential(TABLE_STORAGE_NAME, table_storage_key.value),
+    )
+    table_client = table_service_client.get_table_client(
+        TABLE_STORAGE_OFFERS_TABLE_NAME
+    )
+    eventgrid_client = EventGridPublisherClient(
+        EVENTGRID_TOPIC_ENDPOINT, default_az_credential
+    )
+    return table_client, eventgrid_client
+
+
+_clients = None
+_clients_created_at = 0.0
+_clients_lock = threading.Lock()
+
+
+def get_clients(ttl: int = CLIENTS_TTL_SECONDS):
+    """Table and EventGrid clients, shared by invocations of a warm instance.
+
+    They are recreated (with a fresh Key Vault secret) once older than `ttl` seconds.
+    """
+    global _clients, _clients_created_at
+    with _clients_lock:
+        if _clients is None or time.monotonic() - _clients_created_at > ttl:
+            logging.info("Creating Azure clients")
+            _clients = _create_clients()
+            _clients_created_at = time.monotonic()
+        return _clients
+
+
+def reset_clients():
+    """Drop the shared clients, e.g. after an authentication failure."""
+    global _clients
+    with _clients_lock:
+        _clients = None
+
+
+_seen_offers = None
+
+
+def get_seen_offers():
+    """Seen offers shared by warm invocations, restored from the snapshot when cold."""
+    global _seen_offers
+    with _clients_lock:
+        if _seen_offers is None:
+            _seen_offers = SeenOffers.load(SEEN_OFFERS_SNAPSHOT)
+        return _seen_offers
+
+
 class Manager:
-    def __init__(self):
-        default_az_credential = DefaultAzureCredential()
-        secret_client = SecretClient(
-            vault_url=KEY_VALUT_URL, credential=default_az_credential
-        )
-        table_storage_key = secret_client.get_secret(TABLE_STORAGE_KEY_SECRET_NAME)
-        table_service_client = TableServiceClient(
-            endpoint=f"https://{TABLE_STORAGE_NAME}.table.core.windows.net",
-            credential=AzureNamedKeyCredential(
-                TABLE_STORAGE_NAME, table_storage_key.value
-            ),
-        )
-        self.table_client = table_service_client.get_table_client(
-            TABLE_STORAGE_OFFERS_TABLE_NAME
-        )
-        self.eventgrid_client = EventGridPublisherClient(
-            EVENTGRID_TOPIC_ENDPOINT, default_az_credential
-        )
+    def __init__(self, table_client=None, eventgrid_client=None, seen=None):
+        if table_client is None:
+            table_client, eventgrid_client = get_clients()
+        self.table_client = table_client
+        self.eventgrid_client = eventgrid_client
+        self.seen = seen if seen is not None else get_seen_offers()
+
+    def _check_offers(self, domain: str, uids: list[str]) -> set[str]:
+        """Uids of `uids` already stored.
+
+        Uids seen before are answered locally, the rest is looked up in a few batched
+        queries.
+        """
+        keys = {uid: row_key(uid) for uid in uids}
+        existing = {key for key in keys.values() if self.seen.contains(domain, key)}
+        unknown = set(keys.values()) - existing
+        if unknown:
+            for key in query_existing_row_keys(self.table_client, domain, unknown):
+                self.seen.add(domain, key)
+                existing.add(key)
+        return {uid for uid, key in keys.items() if key in existing}
 
-    def _insert_offer(self, domain: str, uid: str):
-        self.table_client.create_entity(
-            entity={
-                "PartitionKey": domain,
-                "RowKey": hashlib.sha256(uid.encode()).hexdigest(),
+    def _insert_offers(self, domain: str, uids: list[str]):
+        keys = [row_key(uid) for uid in uids]
+        insert_row_keys(self.table_client, domain, keys)
+        for key in keys:
+            self.seen.add(domain, key)
+
+    def _fetch_offer_meta(self, domain_fetch_by_url, offer: dict):
+        """Offer enriched by its detail page, None if the detail fetch failed."""
+        try:
+            offer_meta = {
+                "author": None,
+                "title": None,
+                "description": None,
             }
-        )
-        pass
-
-    def _check_offer(self, domain: str, uid: str):
-        return list(
-            self.table_client.query_entities(
-                query_filter="PartitionKey eq @domain and RowKey eq @uid",
-                parameters={
-                    "domain": domain,
-                    "uid": hashlib.sha256(uid.encode()).hexdigest(),
-                },
+            if domain_fetch_by_url is not None:
+                offer_meta = domain_fetch_by_url(offer["url"])
+        except Exception as e:
+            logging.info(f"Failed to collect offer {offer['url']}")
+            logging.exception(e)
+            return None
+
+        offer_meta.update(offer)
+        return offer_meta
+
+    def _identify_domain_offers(
+        self, domain: str, domain_list, domain_fetch_by_url, filter_query: str
+    ):
+        logging.info(f"Parsing {domain}")
+
+        # A failed listing must not abort the other domains, whose new offers are
+        # stored as seen by now and would never be reported otherwise
+        try:
+            offers = domain_list(filter_query)
+        except Exception as e:
+            logging.info(f"Failed to list offers of {domain}")
+            logging.exception(e)
+            return False, True, []
+        logging.info(f"Collected {len(offers)} offers from {domain}")
+
+        known = self._check_offers(domain, [offer["url"] for offer in offers])
+        new_offers = []
+        for offer in offers:
+            if offer["url"] not in known:
+                known.add(offer["url"])
+                logging.info(f"New offer {offer['url']}")
+                new_offers.append(offer)
+
+        with ThreadPoolExecutor(max_workers=DETAIL_FETCH_CONCURRENCY) as executor:
+            results = list(
+                executor.map(
+                    lambda offer: self._fetch_offer_meta(domain_fetch_by_url, offer),
+                    new_offers,
+                )
             )
-        )
+
+        rich_offers = [offer for offer in results if offer is not None]
+        collection_failed = len(rich_offers) < len(results)
+
+        self._insert_offers(domain, [offer["url"] for offer in rich_offers])
+        return bool(rich_offers), collection_failed, rich_offers
 
     def identify_new_offers(self):
+        """Collect all domains concurrently.
+
+        Returns `(new_offer_detected, collection_failed, offers)`, offers are ordered by
+        domain and listing. A failed listing or detail fetch only marks the collection as
+        failed.
+        """
         new_offer_detected = False
         collection_failed = False
 
         rich_offers = []
 
-        for domain, domain_list, domain_fetch_by_url, filter_query in [
+        domains = [
             ["bazos.cz", bazos_list_offers, bazos_offer_by_url, BAZOS_FILTER_QUERY],
             [
                 "facebook.com",
@@ -98,41 +217,24 @@ class Manager:
                 sreality_offer_by_url,
                 SREALITY_FILTER_QUERY,
             ],
-        ]:
-            logging.info(f"Parsing {domain}")
-
-            offers = domain_list(filter_query)
-            logging.info(f"Collected {len(offers)} offers")
-
-            for offer in offers:
-                detected = self._check_offer(domain=domain, uid=offer["url"])
-                if not len(detected):
-                    logging.info(f"New offer {offer['url']}")
-
-                    try:
-                        offer_meta = {
-                            "author": None,
-                            "title": None,
-                            "description": None,
-                        }
-                        if domain_fetch_by_url is not None:
-                            offer_meta = domain_fetch_by_url(offer["url"])
-                    except Exception as e:
-                        logging.info(f"Failed to collect offer {offer['url']}")
-                        logging.exception(e)
-                        collection_failed = True
-                        continue
-
-                    offer_meta.update(offer)
-                    offer = offer_meta
-                    rich_offers.append(offer)
-
-                    new_offer_detected = True
-                    self._insert_offer(domain=domain, uid=offer["url"])
+        ]
+        with ThreadPoolExecutor(max_workers=len(domains)) as executor:
+            futures = [
+                executor.submit(self._identify_domain_offers, *domain)
+                for domain in domains
+            ]
+            for future in futures:
+                detected, failed, offers = future.result()
+                new_offer_detected = new_offer_detected or detected
+                collection_failed = collection_failed or failed
+                rich_offers.extend(offers)
 
+        self.seen.save()
         return new_offer_detected, collection_failed, rich_offers
 
     def report_new_offers(self, offers_rich: list[dict]):
+        from azure.eventgrid import EventGridEvent
+
         event = EventGridEvent(
             event_type="qaas.reality_market.new_offer_detected",
             data={
@@ -147,6 +249,8 @@ class Manager:
         self.eventgrid_client.send(event)
 
     def report_failure(self, message: str):
+        from azure.eventgrid import EventGridEvent
+
         event = EventGridEvent(
             event_type="qaas.reality_market.failure",
             data={
@@ -1,13 +1,14 @@
-import requests
-from bs4 import BeautifulSoup
+from parsers.client import shared_session
+from parsers.parsing import parse
 
 DOMAIN = "reality.bazos.cz"
 SOURCE_URL = f"https://{DOMAIN}/prodam/byt"
+PARSER = "html.parser"
 
 
 def list_offers(query: str = "/?") -> list[dict]:
-    response = requests.get(f"{SOURCE_URL}{query}")
-    soup = BeautifulSoup(response.content, features="html.parser")
+    response = shared_session().get(f"{SOURCE_URL}{query}")
+    soup = parse(response, PARSER)
     return [
         {"url": f'https://{DOMAIN}{el.attrs["href"]}'}
         for el in soup.select("body div.maincontent .inzeraty .inzeratynadpis > a")
@@ -15,8 +16,8 @@ def list_offers(query: str = "/?") -> list[dict]:
 
 
 def fetch_offer_by_url(url: str):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, features="html.parser")
+    response = shared_session().get(url)
+    soup = parse(response, PARSER)
 
     author = soup.select(
         "body > div > div.flexmain > div.maincontent td.listadvlevo table tr:nth-child(1) td:nth-child(2)"
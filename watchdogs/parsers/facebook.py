@@ -1,11 +1,21 @@
+import re
 import json
-import requests
 import logging
-from bs4 import BeautifulSoup
+from typing import Iterator
+
+from parsers.client import shared_session
+from parsers.parsing import declared_encoding
 
 SOURCE_URL = "https://www.facebook.com/marketplace/category/propertyforsale"
 SOURCE_ITEM_URL = "https://www.facebook.com/marketplace"
 
+# Data of the page's React components, embedded as JSON in script tags. The JSON may
+# not contain "</script>" literally, so the first one ends the payload.
+JSON_SCRIPT_RE = re.compile(
+    rb"""<script\b[^>]*\stype=["']?application/json["']?[^>]*>""", re.IGNORECASE
+)
+JSON_SCRIPT_END_RE = re.compile(rb"</script\s*>", re.IGNORECASE)
+
 HEADERS = {
     "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
     "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36",
@@ -20,26 +30,57 @@ HEADERS = {
 }
 
 
+def json_scripts(content: bytes, *markers: bytes) -> Iterator[bytes]:
+    """JSON payloads of the script tags in `content` containing all `markers`, last
+    first, found in the raw bytes without parsing the page."""
+    payloads = []
+    for match in JSON_SCRIPT_RE.finditer(content):
+        end = JSON_SCRIPT_END_RE.search(content, match.end())
+        if end is None:
+            break
+        payloads.append((match.end(), end.start()))
+
+    for start, end in reversed(payloads):
+        payload = content[start:end]
+        if all(marker in payload for marker in markers):
+            yield payload
+
+
+def find_value(text: str, key: str, has: str):
+    """Decode the value of the first `key` in the JSON `text` which is an object holding
+    `has`, without decoding the rest of the JSON."""
+    key_re = re.compile(r'"%s"\s*:\s*' % re.escape(key))
+    decoder = json.JSONDecoder()
+    for match in key_re.finditer(text):
+        # Only the value is decoded, the text after it is left alone
+        try:
+            value, _ = decoder.raw_decode(text, match.end())
+        except ValueError:
+            continue
+        if isinstance(value, dict) and has in value:
+            return value
+    return None
+
+
+def extract(response, key: str, has: str, *markers: bytes):
+    """Value of `key` holding `has` in the JSON embedded in `response`'s page, see
+    `json_scripts` for `markers`."""
+    encoding = declared_encoding(response) or "utf-8"
+    for payload in json_scripts(response.content, key.encode(), *markers):
+        value = find_value(payload.decode(encoding), key, has)
+        if value is not None:
+            return value
+    raise ValueError(f"{key} not found in {response.url}")
+
+
 def list_offers(query: str = "/?") -> list[dict]:
-    response = requests.get(
+    response = shared_session().get(
         f"{SOURCE_URL}{query}",
         headers=HEADERS,
     )
-    soup = BeautifulSoup(response.content, features="html.parser")
-    data = json.loads(
-        [
-            el
-            for el in soup.select('script[type="application/json"]')
-            if "GroupCommerceProductItem" in str(el)
-            and "marketplace_feed_stories" in str(el)
-        ]
-        .pop()
-        .text
-    )
-
-    data = data["require"][0][3][0]["__bbox"]["require"][0][3][1]["__bbox"]["result"][
-        "data"
-    ]["viewer"]["marketplace_feed_stories"]["edges"]
+    data = extract(
+        response, "marketplace_feed_stories", "edges", b"GroupCommerceProductItem"
+    )["edges"]
 
     return [
         {
@@ -53,21 +94,9 @@ def list_offers(query: str = "/?") -> list[dict]:
 def fetch_offer_by_url(url: str):
     # It is not possible to scrap facebook details from server and this only works from
     # sort of personal ips (have no idea how...)
-    response = requests.get(url, headers=HEADERS)
-
-    soup = BeautifulSoup(response.content, features="html.parser")
-    data = json.loads(
-        [
-            el
-            for el in soup.select('script[type="application/json"]')
-            if "marketplace_product_details_page" in str(el)
-        ]
-        .pop()
-        .text
-    )
-    data = data["require"][0][3][0]["__bbox"]["require"][3][3][1]["__bbox"]["result"][
-        "data"
-    ]["viewer"]["marketplace_product_details_page"]["target"]
+    response = shared_session().get(url, headers=HEADERS)
+
+    data = extract(response, "marketplace_product_details_page", "target")["target"]
 
     return {
         "author": None,
@@ -0,0 +1,37 @@
+import re
+from typing import Optional
+
+from bs4 import BeautifulSoup
+
+# Tree builders producing the same BeautifulSoup API (and soupsieve selectors) the
+# parsers rely on, fastest first.
+PARSERS = ["lxml", "html.parser"]
+DEFAULT_PARSER = "html.parser"
+
+CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+
+
+def declared_encoding(response) -> Optional[str]:
+    """Charset from the Content-Type header, None if the server did not declare one."""
+    match = CHARSET_RE.search(response.headers.get("content-type", ""))
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def parse_html(markup, parser: str = DEFAULT_PARSER, encoding: Optional[str] = None):
+    """Parse `markup` with the `parser` tree builder.
+
+    Bytes with a known `encoding` are decoded up front, which skips BeautifulSoup's
+    charset detection. Bytes that do not decode are left to the detection.
+    """
+    if isinstance(markup, bytes) and encoding is not None:
+        try:
+            markup = markup.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            pass
+    return BeautifulSoup(markup, parser)
+
+
+def parse(response, parser: str = DEFAULT_PARSER):
+    return parse_html(response.content, parser, declared_encoding(response))
@@ -1,8 +1,9 @@
-import requests
-from bs4 import BeautifulSoup
+from parsers.client import shared_session
+from parsers.parsing import parse
 
 DOMAIN = "www.sreality.cz"
 SOURCE_WEB_URL = f"https://{DOMAIN}/hledani"
+PARSER = "html.parser"
 
 HEADERS = {  # Bypass ad agreement
     "Cookie": "last-redirect=1; __cw_snc=1; szncmpone=1; cw_referrer=; euconsent-v2=CQGvaEAQGvaEAD3ACQCSBMFsAP_gAEPgAATIJNQIwAFAAQAAqABkAEAAKAAZAA0ACSAEwAJwAWwAvwBhAGIAQEAggCEAEUAI4ATgAoQBxADuAIQAUgA04COgE2gKkAW4AvMBjID_AIDgRmAk0BecBIACoAIAAZAA0ACYAGIAPwAhABHACcAGaAO4AhABFgE2gKkAW4AvMAAA.YAAAAAAAAWAA"
@@ -10,11 +11,11 @@ HEADERS = {  # Bypass ad agreement
 
 
 def list_offers(query: str = "/?") -> list[dict]:
-    response = requests.get(
+    response = shared_session().get(
         f"{SOURCE_WEB_URL}{query}",
         headers=HEADERS,
     )
-    soup = BeautifulSoup(response.content, features="html.parser")
+    soup = parse(response, PARSER)
     return [
         {"url": f'https://{DOMAIN}{el.attrs["href"]}'}
         for el in soup.select(
@@ -24,8 +25,8 @@ def list_offers(query: str = "/?") -> list[dict]:
 
 
 def fetch_offer_by_url(url: str):
-    response = requests.get(url, headers=HEADERS)
-    soup = BeautifulSoup(response.content, features="html.parser")
+    response = shared_session().get(url, headers=HEADERS)
+    soup = parse(response, PARSER)
 
     author = soup.select(
         "div.MuiBox-root.css-17gcfrm > div.MuiBox-root.css-14kccxu > div.MuiBox-root.css-vq9zkb > div > div.MuiBox-root.css-0 > div > div > section"
@@ -0,0 +1,72 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class SeenOffers:
+    """Offers known to be stored in the offers table, kept across warm invocations.
+
+    The `recent_size` most recently seen keys are kept exactly, a key is only reported
+    as seen if it is one of them. Keys which are not must be checked in the table, a
+    false positive would suppress a new offer.
+    """
+
+    def __init__(self, recent_size: int = 10_000, path: Optional[str] = None):
+        self.recent = OrderedDict()
+        self.recent_size = recent_size
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(domain: str, row_key: str) -> str:
+        return f"{row_key}:{domain}"
+
+    def contains(self, domain: str, row_key: str) -> bool:
+        key = self._key(domain, row_key)
+        with self._lock:
+            if key in self.recent:
+                self.recent.move_to_end(key)
+                return True
+            return False
+
+    def add(self, domain: str, row_key: str):
+        key = self._key(domain, row_key)
+        with self._lock:
+            self.recent[key] = None
+            self.recent.move_to_end(key)
+            if len(self.recent) > self.recent_size:
+                self.recent.popitem(last=False)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            snapshot = {"recent": list(self.recent)}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs):
+        """Restore a snapshot from `path`, start empty if there is none (or it is broken)."""
+        seen = cls(path=path, **kwargs)
+        try:
+            with open(path) as f:
+                recent = json.load(f)["recent"]
+        except FileNotFoundError:
+            return seen
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring broken seen offers snapshot {path}: {e}")
+            return seen
+
+        for key in recent[-seen.recent_size :]:
+            seen.recent[key] = None
+        return seen
+
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(tempfile.gettempdir(), "realitymarket-seen.json")
@@ -0,0 +1,41 @@
+import hashlib
+from typing import Iterable
+
+# Azure Table Storage allows at most 15 comparisons in one filter, one is the PartitionKey
+QUERY_BATCH_SIZE = 14
+# Entity group transactions are limited to 100 operations within one partition
+TRANSACTION_BATCH_SIZE = 100
+
+
+def row_key(uid: str) -> str:
+    return hashlib.sha256(uid.encode()).hexdigest()
+
+
+def chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def query_existing_row_keys(table_client, domain: str, row_keys: Iterable[str]) -> set:
+    """RowKeys of `row_keys` already stored in the `domain` partition, 14 per query."""
+    existing = set()
+    for batch in chunks(sorted(set(row_keys)), QUERY_BATCH_SIZE):
+        parameters = {"domain": domain}
+        conditions = []
+        for i, key in enumerate(batch):
+            parameters[f"k{i}"] = key
+            conditions.append(f"RowKey eq @k{i}")
+        entities = table_client.query_entities(
+            query_filter=f"PartitionKey eq @domain and ({' or '.join(conditions)})",
+            parameters=parameters,
+            select=["RowKey"],
+        )
+        existing.update(entity["RowKey"] for entity in entities)
+    return existing
+
+
+def insert_row_keys(table_client, domain: str, row_keys: Iterable[str]):
+    """Store `row_keys` in the `domain` partition, up to 100 per transaction."""
+    entities = [{"PartitionKey": domain, "RowKey": key} for key in row_keys]
+    for batch in chunks(entities, TRANSACTION_BATCH_SIZE):
+        table_client.submit_transaction([("upsert", entity) for entity in batch])
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The function app imports its modules relative to its own directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,101 @@
+import re
+
+from storage import TRANSACTION_BATCH_SIZE
+
+# Comparisons Azure Table Storage allows in one filter
+MAX_COMPARISONS = 15
+
+
+class MemoryTableClient:
+    """In-process stand-in for `azure.data.tables.TableClient`.
+
+    Supports the calls the Manager makes, filters may combine `eq` comparisons of
+    string properties and `@` parameters with `and`, `or` and parentheses. Like the
+    real service, a transaction is applied entirely or not at all, transactions with
+    an entity of `fail_row_keys` fail.
+    """
+
+    TOKEN_RE = re.compile(r"\s*(\(|\)|'(?:[^']|'')*'|@\w+|\w+)")
+
+    def __init__(self, fail_row_keys=()):
+        self.entities = {}
+        self.calls = []
+        self.transactions = []
+        self.fail_row_keys = set(fail_row_keys)
+
+    def create_entity(self, entity: dict):
+        self.calls.append("create_entity")
+        key = (entity["PartitionKey"], entity["RowKey"])
+        if key in self.entities:
+            raise KeyError(f"Entity already exists: {key}")
+        self.entities[key] = dict(entity)
+
+    def submit_transaction(self, operations):
+        self.calls.append("submit_transaction")
+        operations = list(operations)
+        if len(operations) > TRANSACTION_BATCH_SIZE:
+            raise ValueError("Too many operations in one transaction")
+        if len({op[1]["PartitionKey"] for op in operations}) > 1:
+            raise ValueError("Transaction spans multiple partitions")
+        if any(op[1]["RowKey"] in self.fail_row_keys for op in operations):
+            raise RuntimeError("Transaction failed")
+        applied = dict(self.entities)
+        for operation, entity, *_ in operations:
+            key = (entity["PartitionKey"], entity["RowKey"])
+            if operation == "create" and key in applied:
+                raise KeyError(f"Entity already exists: {key}")
+            applied[key] = dict(entity)
+        self.entities = applied
+        self.transactions.append(len(operations))
+
+    def query_entities(self, query_filter: str, parameters: dict = None, select=None):
+        self.calls.append("query_entities")
+        tokens = self.TOKEN_RE.findall(query_filter)
+        comparisons = tokens.count("eq")
+        if comparisons > MAX_COMPARISONS:
+            raise ValueError(f"Filter with {comparisons} comparisons")
+        matched = [
+            entity
+            for entity in self.entities.values()
+            if self._evaluate(list(tokens), parameters or {}, entity)
+        ]
+        if select is not None:
+            matched = [
+                {k: entity[k] for k in select if k in entity} for entity in matched
+            ]
+        return iter(matched)
+
+    def _evaluate(self, tokens, parameters, entity):
+        def value(token):
+            if token.startswith("@"):
+                return parameters[token[1:]]
+            if token.startswith("'"):
+                return token[1:-1].replace("''", "'")
+            return entity.get(token)
+
+        def expression():
+            result = term()
+            while tokens and tokens[0] == "or":
+                tokens.pop(0)
+                result = term() or result
+            return result
+
+        def term():
+            result = factor()
+            while tokens and tokens[0] == "and":
+                tokens.pop(0)
+                result = factor() and result
+            return result
+
+        def factor():
+            token = tokens.pop(0)
+            if token == "(":
+                result = expression()
+                tokens.pop(0)
+                return result
+            operator, right = tokens.pop(0), tokens.pop(0)
+            if operator != "eq":
+                raise ValueError(f"Unsupported operator: {operator}")
+            return value(token) == value(right)
+
+        return expression()
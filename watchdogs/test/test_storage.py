@@ -0,0 +1,59 @@
+import pytest
+
+from memory_table import MemoryTableClient
+from storage import (
+    QUERY_BATCH_SIZE,
+    TRANSACTION_BATCH_SIZE,
+    insert_row_keys,
+    query_existing_row_keys,
+    row_key,
+)
+
+
+def keys(count: int, prefix: str = "offer"):
+    return [row_key(f"{prefix}-{i}") for i in range(count)]
+
+
+@pytest.mark.parametrize("count", [QUERY_BATCH_SIZE, QUERY_BATCH_SIZE + 1])
+def test_query_existing_row_keys_batches(count):
+    table = MemoryTableClient()
+    stored = keys(count)
+    insert_row_keys(table, "bazos.cz", stored)
+    insert_row_keys(table, "sreality.cz", keys(count, "other"))
+    table.calls.clear()
+
+    existing = query_existing_row_keys(table, "bazos.cz", stored + keys(count, "other"))
+
+    assert existing == set(stored)
+    # 14 keys, one PartitionKey comparison, per filter
+    assert table.calls.count("query_entities") == -(-2 * count // QUERY_BATCH_SIZE)
+
+
+def test_query_existing_row_keys_without_keys():
+    table = MemoryTableClient()
+    assert query_existing_row_keys(table, "bazos.cz", []) == set()
+    assert table.calls == []
+
+
+def test_insert_row_keys_chunks_transactions():
+    table = MemoryTableClient()
+    row_keys = keys(2 * TRANSACTION_BATCH_SIZE + 1)
+
+    insert_row_keys(table, "bazos.cz", row_keys)
+
+    assert table.transactions == [TRANSACTION_BATCH_SIZE, TRANSACTION_BATCH_SIZE, 1]
+    assert set(table.entities) == {("bazos.cz", key) for key in row_keys}
+
+
+def test_insert_row_keys_failed_transaction():
+    row_keys = keys(2 * TRANSACTION_BATCH_SIZE)
+    table = MemoryTableClient(fail_row_keys=[row_keys[TRANSACTION_BATCH_SIZE + 5]])
+
+    with pytest.raises(RuntimeError):
+        insert_row_keys(table, "bazos.cz", row_keys)
+
+    # Transactions before the failed one stay stored, none of the failed one is
+    assert table.transactions == [TRANSACTION_BATCH_SIZE]
+    assert set(table.entities) == {
+        ("bazos.cz", key) for key in row_keys[:TRANSACTION_BATCH_SIZE]
+    }